@@ -1,8 +1,9 @@
-import copy
 import numpy as np
 from torch.autograd import Variable
 import torch
 
+from utils.torch_utils import ModelExecution
+
 import pdb
 
 
@@ -11,64 +12,84 @@ class DIM_Attack(object):
                        decay_factor=1, prob=0.5,
                        epsilon=0.3, steps=40, step_size=0.01, 
                        image_resize=330,
-                       random_start=False):
+                       random_start=False,
+                       device='cuda', precision='fp32', channels_last=False):
         """
         Paper link: https://arxiv.org/pdf/1803.06978.pdf
+        precision and channels_last: see utils.torch_utils.ModelExecution.
         """
 
         self.epsilon = epsilon
         self.steps = steps
         self.step_size = step_size
         self.rand = random_start
-        self.model = copy.deepcopy(model)
-        self.loss_fn = torch.nn.CrossEntropyLoss().cuda()
+        self.execution = ModelExecution(device, precision, channels_last)
+        self.device = self.execution.device
+        self.model = self.execution.prepare(model)
+        # summed so that every sample gets the gradient it would get alone.
+        self.loss_fn = torch.nn.CrossEntropyLoss(reduction='sum')
         self.decay_factor = decay_factor
         self.prob = prob
         self.image_resize = image_resize
 
-    def __call__(self, X_nat, y):
+    def __call__(self, X_nat, y, seeds=None):
         """
         Given examples (X_nat, y), returns adversarial
         examples within epsilon of X_nat in l_infinity norm.
+        y holds one label per sample. seeds optionally gives one random
+        seed per sample, a batch then gives the same result as attacking
+        its samples one at a time with the same seeds.
         """
         X_nat_np = X_nat.numpy()
         for p in self.model.parameters():
             p.requires_grad = False
         
         self.model.eval()
+        rngs = [np.random.RandomState(seed) for seed in seeds] if seeds is not None else [np.random] * len(X_nat_np)
         if self.rand:
-            X = X_nat_np + np.random.uniform(-self.epsilon, self.epsilon,
-                X_nat_np.shape).astype('float32')
+            X = X_nat_np + np.array([rng.uniform(-self.epsilon, self.epsilon,
+                X_nat_np.shape[1:]) for rng in rngs]).astype('float32')
         else:
             X = np.copy(X_nat_np)
-        
-        momentum = 0
-        for _ in range(self.steps):
-            X_var = Variable(torch.from_numpy(X).cuda(), requires_grad=True, volatile=False)
-            y_var = y.cuda()
 
-            rnd = np.random.rand()
-            if rnd < self.prob:
-                transformer = _tranform_resize_padding(X.shape[-2], X.shape[-1], self.image_resize, resize_back=True)
-                X_trans_var = transformer(X_var)
-            else:
-                X_trans_var = X_var
+        # attack state stays on the device, only the result is copied back.
+        X_var = torch.from_numpy(X).to(self.device).requires_grad_()
+        y_var = y.to(self.device)
+        momentum = torch.zeros_like(X_var)
+        # epsilon ball and valid pixel range folded into one pair of bounds.
+        X_nat_var = X_nat.to(self.device)
+        lower_var = torch.clamp(X_nat_var - self.epsilon, 0, 1)
+        upper_var = torch.clamp(X_nat_var + self.epsilon, 0, 1)
+        del X_nat_var
+
+        for _ in range(self.steps):
+            # input diversity is drawn independently for every sample.
+            transformer = _tranform_resize_padding(X.shape[-2], X.shape[-1], self.image_resize, resize_back=True)
+            X_trans_list = []
+            for idx, rng in enumerate(rngs):
+                X_sample_var = X_var[idx:idx + 1]
+                rnd = rng.rand()
+                if rnd < self.prob:
+                    X_sample_var = transformer(X_sample_var, rng=rng)
+                X_trans_list.append(X_sample_var)
+            X_trans_var = torch.cat(X_trans_list)
 
-            scores = self.model(X_trans_var)
+            scores = self.execution(self.model, X_trans_var)
             
             loss = self.loss_fn(scores, y_var)
             self.model.zero_grad()
             loss.backward()
-            grad = X_var.grad.data.cpu().numpy()
-            X_var.grad.zero_()
 
-            velocity = grad / np.mean(np.absolute(grad))
-            momentum = self.decay_factor * momentum + velocity
+            with torch.no_grad():
+                grad = X_var.grad
+                velocity = grad.div_(grad.abs().mean(dim=(1, 2, 3), keepdim=True))
+                momentum.mul_(self.decay_factor).add_(velocity)
 
-            X += self.step_size * np.sign(momentum)
-            X = np.clip(X, X_nat_np - self.epsilon, X_nat_np + self.epsilon)
-            X = np.clip(X, 0, 1) # ensure valid pixel range
-        return torch.from_numpy(X)
+                X_var.add_(self.step_size * momentum.sign())
+                torch.min(X_var, upper_var, out=X_var)
+                torch.max(X_var, lower_var, out=X_var)
+            X_var.grad.zero_()
+        return X_var.detach().cpu()
 
 
 class _tranform_resize_padding(torch.nn.Module):
@@ -78,15 +99,15 @@ class _tranform_resize_padding(torch.nn.Module):
         self.image_resize = image_resize
         self.resize_back = resize_back
 
-    def __call__(self, input_tensor):
+    def __call__(self, input_tensor, rng=np.random):
         assert self.shape[0] < self.image_resize and self.shape[1] < self.image_resize
-        rnd = np.random.randint(self.shape[1], self.image_resize)
+        rnd = rng.randint(self.shape[1], self.image_resize)
         input_upsample = torch.nn.functional.interpolate(input_tensor, size=(rnd, rnd), mode='nearest')
         h_rem = self.image_resize - rnd
         w_rem = self.image_resize - rnd
-        pad_top = np.random.randint(0, h_rem)
+        pad_top = rng.randint(0, h_rem)
         pad_bottom = h_rem - pad_top
-        pad_left = np.random.randint(0, w_rem)
+        pad_left = rng.randint(0, w_rem)
         pad_right = w_rem - pad_left
         padder = torch.nn.ConstantPad2d((pad_left, pad_right, pad_top, pad_bottom), 0.0)
         input_padded = padder(input_upsample)
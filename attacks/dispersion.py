@@ -1,26 +1,36 @@
 import copy
 import os
 import shutil
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
 import torch
 from torch.autograd import Variable
 import torch.nn.functional as F
 
-from utils.torch_utils import numpy_to_variable, variable_to_numpy
-from utils.api_utils import detect_label_file, detect_objects_file, googleDet_to_Dictionary
-from utils.image_utils import save_bbox_img
+from utils.torch_utils import numpy_to_variable, variable_to_numpy, ModelExecution
+from utils.image_utils import save_bbox_img, numpy_to_bytes
 
 import pdb
 
 
 class DispersionAttack_gpu(object):
-    def __init__(self, model, epsilon=16/255., step_size=0.004, steps=10, loss_mtd='std'):
+    def __init__(self, model, epsilon=16/255., step_size=0.004, steps=10, loss_mtd='std', attack_layer_idx_list=None,
+                 device='cuda', precision='fp32', channels_last=False):
         
         self.step_size = step_size
         self.epsilon = epsilon
         self.steps = steps
-        self.model = copy.deepcopy(model).cuda()
+        self.execution = ModelExecution(device, precision, channels_last)
+        self.device = self.execution.device
+        self.model = self.execution.prepare(model)
+        # With attack_layer_idx_list given, every step only runs the model up
+        # to the deepest attacked layer. The indices are layer indices of the
+        # model, i.e. internal has to be range(n) when calling the attack.
+        self.truncated_model = None
+        if attack_layer_idx_list is not None:
+            self.truncated_model = self.model.truncate(attack_layer_idx_list)
         self.loss_mtd = loss_mtd
         if loss_mtd == 'std':
             self.loss_fn = self._std_loss
@@ -30,23 +40,35 @@ class DispersionAttack_gpu(object):
             self.loss_fn = self._l1smooth_avg_loss
         elif loss_mtd == 'selective_loss':
             self.loss_fn = self._selective_loss
-            self.selected_idx_list = None
+            self.selected_mask_list = None
         else:
             raise ValueError('')
+        self.l1_smooth_loss = torch.nn.SmoothL1Loss()
 
     def __call__(self, X_nat_var, attack_layer_idx_list, internal):
         for p in self.model.parameters():
             p.requires_grad = False
         self.model.eval()
         X_var = copy.deepcopy(X_nat_var)
+        if self.loss_mtd == 'selective_loss':
+            # selection masks belong to the current batch only.
+            self.selected_mask_list = None
         for i in range(self.steps):
             X_var = X_var.requires_grad_()
-            internal_logits, _ = self.model.prediction(X_var, internal=internal)
-            logit_list = [internal_logits[x] for x in attack_layer_idx_list]
+            with self.execution.autocast():
+                X_model_var = self.execution.input(X_var)
+                if self.truncated_model is not None:
+                    assert list(attack_layer_idx_list) == self.truncated_model.layer_idx_list
+                    logit_list = self.truncated_model(X_model_var)
+                else:
+                    internal_logits, _ = self.model.prediction(X_model_var, internal=internal, with_pred=False)
+                    logit_list = [internal_logits[x] for x in attack_layer_idx_list]
+            # fp32 NCHW feature maps, channels_last ones cannot be view()ed by the losses.
+            logit_list = [logit.float().contiguous() for logit in logit_list]
 
             if self.loss_mtd == 'selective_loss':
-                if self.selected_idx_list is None:
-                    self.selected_idx_list = self.__init_selective_loss(logit_list, 0.5)
+                if self.selected_mask_list is None:
+                    self.selected_mask_list = self.__init_selective_loss(logit_list, 0.5)
 
             #print(i, ' , std: ', [x.std() for x in logit_list])
 
@@ -73,45 +95,27 @@ class DispersionAttack_gpu(object):
         return -1 * logit.view(logit.shape[0], -1).std(1)
 
     def _l1smooth_zero_loss(self, logit):
-        l1_smooth_loss = torch.nn.SmoothL1Loss().cuda()
-        gt = torch.zeros(logit.shape, requires_grad=False, dtype=torch.float32).cuda()
-        return -1 * l1_smooth_loss(logit, gt)
+        return -1 * _l1smooth_to_zero(logit).mean()
 
     def _l1smooth_avg_loss(self, logit):
-        l1_smooth_loss = torch.nn.SmoothL1Loss().cuda()
         logit = logit.view(logit.shape[0], -1)
         avg = logit.mean(1).unsqueeze_(-1)
-        gt = avg.repeat((1, logit.shape[-1])).detach()
-        return -1 * l1_smooth_loss(logit, gt)
+        gt = avg.expand_as(logit).detach()
+        return -1 * self.l1_smooth_loss(logit, gt)
 
     def _selective_loss(self, logit):
-        l1_smooth_loss = torch.nn.SmoothL1Loss().cuda()
         logit = logit.view(logit.shape[0], -1)
-        selected_id = self.selected_idx_list[self.logit_idx]
-        loss = None
-        for batch_idx, curt_logit in enumerate(logit):
-            curt_selected_id = selected_id[batch_idx]
-            selected_curt_logit = curt_logit[curt_selected_id]
-            gt = torch.zeros(selected_curt_logit.shape, requires_grad=False, dtype=torch.float32).cuda()
-            curt_loss = l1_smooth_loss(selected_curt_logit, gt)
-            if loss is None:
-                loss = curt_loss
-            else:
-                loss += curt_loss
-        return -1 * loss / logit.shape[0]
+        selected_mask = self.selected_mask_list[self.logit_idx]
+        # mean l1 smooth loss over the selected entries of every sample.
+        loss = _l1smooth_to_zero(logit).masked_fill(~selected_mask, 0).sum(1) / selected_mask.sum(1).to(logit.dtype)
+        return -1 * loss.mean()
 
     def __init_selective_loss(self, logit_list, th_ratio):
         ret_list = []
         for _, logit in enumerate(logit_list):
-            logit = logit.view(logit.shape[0], -1)
-            logit_cp = logit.clone().detach().cpu().numpy()
-            thresholds = logit_cp.max(axis=-1)
-            arg_idx_list = []
-            for th_idx, th_max in enumerate(thresholds):
-                th = th_max * th_ratio
-                arg_id = np.argwhere(logit_cp[th_idx] >= th).reshape(-1)
-                arg_idx_list.append(arg_id)
-            ret_list.append(arg_idx_list)
+            logit = logit.detach().view(logit.shape[0], -1)
+            thresholds = logit.max(dim=-1, keepdim=True)[0] * th_ratio
+            ret_list.append(logit >= thresholds)
 
             #top_number = int(logit.shape[-1] * ratio)
             #_, large_idx = torch.topk(logit, top_number, dim=-1)
@@ -121,9 +125,18 @@ class DispersionAttack_gpu(object):
         return ret_list
 
 
+def _l1smooth_to_zero(logit):
+    # element-wise SmoothL1Loss(logit, 0), without allocating the zero target.
+    abs_logit = logit.abs()
+    return torch.where(abs_logit < 1, 0.5 * abs_logit ** 2, abs_logit - 0.5)
+
+
 class DispersionAttack_opt(object):
-    def __init__(self, model, epsilon=0.063, learning_rate=5e-2, steps=100, regularization_weight=0, is_test_api=False, is_test_model=False):
+    def __init__(self, model, epsilon=0.063, learning_rate=5e-2, steps=100, regularization_weight=0, is_test_api=False, is_test_model=False, max_api_probes=2, device_optimizer=True, device='cuda'):
         
+        self.device = torch.device(device)
+        self.max_api_probes = max_api_probes
+        self.device_optimizer = device_optimizer
         self.learning_rate = learning_rate
         self.epsilon = epsilon
         self.steps = steps
@@ -131,77 +144,164 @@ class DispersionAttack_opt(object):
         self.regularization_weight = regularization_weight
         self.is_test_api = is_test_api
         self.is_test_model = is_test_model
-        self.loss_fn = torch.nn.CrossEntropyLoss().cuda()
         assert (self.is_test_api and self.is_test_model) == False, "At most one of the test can be activated."
 
     def __call__(self, X_nat, attack_layer_idx=-1, internal=[], test_steps=None, gt_label=None, test_model=None):
         """
         Given examples (X_nat, y), returns adversarial
         examples within epsilon of X_nat in l_infinity norm.
+
+        The loss is a sum of per-sample terms, so the samples of a batch
+        are optimized independently.
+
+        With is_test_model, test_model is run every test_steps and samples
+        it no longer labels gt_label are frozen and dropped from the batch,
+        later steps only run on the unsolved ones. gt_label is either one
+        label per sample, then info_dict holds per-sample lists of
+        end_epoch/det_label/loss (None for samples never solved), or a
+        single label for a single image, then info_dict is only filled when
+        the image is solved.
+
+        With is_test_api, the API is probed in the background every
+        test_steps while the optimisation keeps stepping. The first probe,
+        in step order, that changes the API label stops the attack and
+        returns the image that was probed, even if its answer arrives a few
+        steps later.
         """
         if self.is_test_model:
             assert test_model is not None, "test_model has to be specified when is_test_model is activated."
 
         info_dict = {}
 
-        X_nat_np = X_nat.cpu().numpy()
         for p in self.model.parameters():
             p.requires_grad = False
-        
-        X = np.copy(X_nat_np)
-        optimizer = AdamOptimizer(X.shape)
-
-        ori_label = None
-        for i in range(self.steps):
-            X_nat_var = Variable(torch.from_numpy(X_nat_np).cuda(), requires_grad=False, volatile=False)
-            X_var = Variable(torch.from_numpy(X).cuda(), requires_grad=True, volatile=False)
 
-            internal_logits, pred = self.model.prediction(X_var, internal=internal)
-
-            if i == 0:
-                ori_label = torch.max(pred[0], 0)[1]
-                ori_label = ori_label.unsqueeze(0)
-            cls_loss = self.loss_fn(pred, ori_label)
-            logit = internal_logits[attack_layer_idx]
-            loss = -1 * logit.std() + 0. * cls_loss + self.regularization_weight * F.l1_loss(X_nat_var, X_var, reduction='mean')
-            loss.backward()
-
-            grad = X_var.grad.data.cpu().numpy()
-            X += optimizer(grad, learning_rate=self.learning_rate)
-
-            X = np.clip(X, X_nat_np - self.epsilon, X_nat_np + self.epsilon)
-            X = np.clip(X, 0, 1) # ensure valid pixel range
-
-            if self.is_test_model and i % test_steps == 0:
-            
-                adv_np = X
-                adv_var = torch.from_numpy(adv_np).cuda()
-                pred = test_model(adv_var).detach().cpu().numpy()
-                pred_label = np.argmax(pred)
-                if gt_label is not None:
-                    if gt_label != pred_label:
-                        info_dict['end_epoch'] = i
-                        info_dict['det_label'] = pred_label
-                        info_dict['loss'] = loss.detach().cpu().numpy()
-                        return torch.from_numpy(X), info_dict
-
-            if self.is_test_api and i % test_steps == 0:
-                adv_np = X
-                Image.fromarray(np.transpose((adv_np[0] * 255.).astype(np.uint8), (1, 2, 0))).save('./temp/temp_dispersion_opt.jpg')
-                google_label = detect_label_file('./temp/temp_dispersion_opt.jpg')
-                if len(google_label) > 0:
-                    pred_cls = google_label[0].description
-                else:
-                    pred_cls = 'none'
+        # X, the natural image and the clip bounds live on the device for the whole run.
+        X_nat_var = X_nat.to(self.device)
+        lower_var = torch.clamp(X_nat_var - self.epsilon, min=0)
+        upper_var = torch.clamp(X_nat_var + self.epsilon, max=1)
+        X_var = X_nat_var.clone().requires_grad_()
+        if self.device_optimizer:
+            optimizer = AdamOptimizer_gpu(X_var)
+        else:
+            optimizer = AdamOptimizer(X_var.shape)
+
+        batch_size = X_var.shape[0]
+        track_samples = self.is_test_model and gt_label is not None
+        if track_samples:
+            per_sample_info = np.ndim(gt_label) > 0
+            gt_labels = np.broadcast_to(np.asarray(gt_label).reshape(-1), (batch_size,))
+            # active_idx[j] is the batch index of the j-th sample still optimized.
+            active_idx = np.arange(batch_size)
+            X_out = X_nat_var.clone()
+            end_epoch_list = [None] * batch_size
+            det_label_list = [None] * batch_size
+            loss_list = [None] * batch_size
+
+        if self.is_test_api:
+            from utils.api_utils import detect_label_image
+            probe_executor = ThreadPoolExecutor(max_workers=self.max_api_probes)
+            pending_probes = collections.deque()
 
-                if gt_label is not None:
-                    if gt_label != pred_cls and gt_label != 'none':
-                        info_dict['end_epoch'] = i
-                        info_dict['det_label'] = pred_cls
-                        info_dict['loss'] = loss.detach().cpu().numpy()
-                        return torch.from_numpy(X), info_dict
+        ori_label = None
+        try:
+            for i in range(self.steps):
+                X_var.grad = None
+                internal_logits, pred = self.model.prediction(X_var, internal=internal)
+
+                if i == 0:
+                    ori_label = pred.detach().argmax(1)
+                num_active = X_var.shape[0]
+                cls_loss = F.cross_entropy(pred, ori_label, reduction='none')
+                logit = internal_logits[attack_layer_idx]
+                reg_loss = F.l1_loss(X_nat_var, X_var, reduction='none').view(num_active, -1).mean(1)
+                loss_per_sample = -1 * logit.view(num_active, -1).std(1) + 0. * cls_loss + self.regularization_weight * reg_loss
+                loss = loss_per_sample.sum()
+                loss.backward()
+
+                with torch.no_grad():
+                    if self.device_optimizer:
+                        optimizer.step_(X_var, X_var.grad, learning_rate=self.learning_rate)
+                    else:
+                        grad = X_var.grad.data.cpu().numpy()
+                        X_var.add_(torch.from_numpy(optimizer(grad, learning_rate=self.learning_rate)).to(X_var))
+                    torch.max(X_var, lower_var, out=X_var)
+                    torch.min(X_var, upper_var, out=X_var) # ensure valid pixel range
+
+                if track_samples and i % test_steps == 0:
+                    with torch.no_grad():
+                        pred_label = test_model(X_var.detach()).argmax(1).cpu().numpy()
+                    fooled = pred_label != gt_labels[active_idx]
+                    if fooled.any():
+                        fooled_var = torch.from_numpy(np.nonzero(fooled)[0]).to(X_var.device)
+                        X_out[torch.from_numpy(active_idx[fooled]).to(X_var.device)] = X_var.detach()[fooled_var]
+                        loss_np = loss_per_sample.detach().cpu().numpy()
+                        for j in np.nonzero(fooled)[0]:
+                            end_epoch_list[active_idx[j]] = i
+                            det_label_list[active_idx[j]] = pred_label[j]
+                            loss_list[active_idx[j]] = loss_np[j]
+                        if fooled.all():
+                            active_idx = active_idx[:0]
+                            break
+                        # freeze the solved samples, only the unsolved ones are optimized from now on.
+                        keep_var = torch.from_numpy(np.nonzero(~fooled)[0]).to(X_var.device)
+                        X_var = X_var.detach()[keep_var].requires_grad_()
+                        X_nat_var = X_nat_var[keep_var]
+                        lower_var = lower_var[keep_var]
+                        upper_var = upper_var[keep_var]
+                        ori_label = ori_label[keep_var]
+                        optimizer.keep_(keep_var)
+                        active_idx = active_idx[~fooled]
+
+                if self.is_test_api:
+                    if i % test_steps == 0:
+                        adv_np = X_var.detach().cpu().numpy()
+                        image = numpy_to_bytes(adv_np[0])
+                        pending_probes.append((i, adv_np, loss.detach().cpu().numpy(), probe_executor.submit(detect_label_image, image)))
+                    ret = self._pop_api_probes(pending_probes, gt_label, info_dict, wait=False)
+                    if ret is not None:
+                        return ret
+
+            if self.is_test_api:
+                ret = self._pop_api_probes(pending_probes, gt_label, info_dict, wait=True)
+                if ret is not None:
+                    return ret
+        finally:
+            if self.is_test_api:
+                probe_executor.shutdown(wait=False)
+
+        if track_samples:
+            if len(active_idx) > 0:
+                X_out[torch.from_numpy(active_idx).to(X_out.device)] = X_var.detach()
+            if per_sample_info:
+                info_dict['end_epoch'] = end_epoch_list
+                info_dict['det_label'] = det_label_list
+                info_dict['loss'] = loss_list
+            elif end_epoch_list[0] is not None:
+                info_dict['end_epoch'] = end_epoch_list[0]
+                info_dict['det_label'] = det_label_list[0]
+                info_dict['loss'] = loss_list[0]
+            return X_out.cpu(), info_dict
+
+        return X_var.detach().cpu(), info_dict
+
+    def _pop_api_probes(self, pending_probes, gt_label, info_dict, wait):
+        """consume the finished probes, oldest first, until one fools the API."""
+        while len(pending_probes) > 0 and (wait or pending_probes[0][3].done()):
+            step, adv_np, loss_np, future = pending_probes.popleft()
+            google_label = future.result()
+            if len(google_label) > 0:
+                pred_cls = google_label[0].description
+            else:
+                pred_cls = 'none'
 
-        return torch.from_numpy(X), info_dict
+            if gt_label is not None:
+                if gt_label != pred_cls and gt_label != 'none':
+                    info_dict['end_epoch'] = step
+                    info_dict['det_label'] = pred_cls
+                    info_dict['loss'] = loss_np
+                    return torch.from_numpy(adv_np), info_dict
+        return None
 
 
 class AdamOptimizer:
@@ -220,6 +320,12 @@ class AdamOptimizer:
         self.v = np.zeros(shape)
         self.t = 0
 
+    def keep_(self, index):
+        """only keep the state of the samples in index along the batch axis."""
+        index = index.cpu().numpy() if torch.is_tensor(index) else index
+        self.m = self.m[index]
+        self.v = self.v[index]
+
     def __call__(self, gradient, learning_rate,
                  beta1=0.98, beta2=0.999, epsilon=10e-8):
         """Updates internal parameters of the optimizer and returns the
@@ -252,4 +358,47 @@ class AdamOptimizer:
         m_hat = self.m / bias_correction_1
         v_hat = self.v / bias_correction_2
 
-        return -learning_rate * m_hat / (np.sqrt(v_hat) + epsilon)
\ No newline at end of file
+        return -learning_rate * m_hat / (np.sqrt(v_hat) + epsilon)
+
+
+class AdamOptimizer_gpu:
+    """Device resident AdamOptimizer.
+
+    Same update rule and defaults as AdamOptimizer, with float32 moment
+    buffers allocated once on the device of the variable and updated in
+    place.
+
+    Parameters
+    ----------
+    variable : `torch.Tensor`
+        the variable w.r.t. which the loss should be minimized.
+
+    """
+
+    def __init__(self, variable):
+        self.m = torch.zeros_like(variable, dtype=torch.float32)
+        self.v = torch.zeros_like(variable, dtype=torch.float32)
+        self.t = 0
+
+    def keep_(self, index):
+        """only keep the state of the samples in index along the batch axis."""
+        self.m = self.m[index]
+        self.v = self.v[index]
+
+    def step_(self, variable, gradient, learning_rate,
+              beta1=0.98, beta2=0.999, epsilon=10e-8):
+        """Updates internal parameters of the optimizer and applies the
+        change to variable in place, see AdamOptimizer.__call__.
+        """
+        self.t += 1
+
+        self.m.mul_(beta1).add_(gradient, alpha=1 - beta1)
+        self.v.mul_(beta2).addcmul_(gradient, gradient, value=1 - beta2)
+
+        bias_correction_1 = 1 - beta1 ** self.t
+        bias_correction_2 = 1 - beta2 ** self.t
+
+        # -lr * m_hat / (sqrt(v_hat) + epsilon)
+        denom = (self.v / bias_correction_2).sqrt_().add_(epsilon)
+        variable.addcdiv_(self.m, denom, value=-learning_rate / bias_correction_1)
+        return variable
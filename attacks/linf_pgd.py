@@ -1,55 +1,71 @@
-import copy
 import numpy as np
 from torch.autograd import Variable
 import torch
 
+from utils.torch_utils import ModelExecution
+
 import pdb
 
 class LinfPGDAttack(object):
     def __init__(self, model, epsilon=0.3, k=40, a=0.01, 
-        random_start=True):
+        random_start=True, device='cuda', precision='fp32', channels_last=False):
         """
         Attack parameter initialization. The attack performs k steps of
         size a, while always staying within epsilon from the initial
         point.
         https://github.com/MadryLab/mnist_challenge/blob/master/pgd_attack.py
+        precision and channels_last: see utils.torch_utils.ModelExecution.
         """
 
         self.epsilon = epsilon
         self.k = k
         self.a = a
         self.rand = random_start
-        self.model = copy.deepcopy(model)
-        self.loss_fn = torch.nn.CrossEntropyLoss().cuda()
+        self.execution = ModelExecution(device, precision, channels_last)
+        self.device = self.execution.device
+        self.model = self.execution.prepare(model)
+        # summed so that every sample gets the gradient it would get alone.
+        self.loss_fn = torch.nn.CrossEntropyLoss(reduction='sum')
 
-    def __call__(self, X_nat, y):
+    def __call__(self, X_nat, y, seeds=None):
         """
         Given examples (X_nat, y), returns adversarial
         examples within epsilon of X_nat in l_infinity norm.
+        y holds one label per sample. seeds optionally gives one random
+        seed per sample, a batch then gives the same result as attacking
+        its samples one at a time with the same seeds.
         """
         X_nat_np = X_nat.numpy()
         for p in self.model.parameters():
             p.requires_grad = False
         
         self.model.eval()
+        rngs = [np.random.RandomState(seed) for seed in seeds] if seeds is not None else [np.random] * len(X_nat_np)
         if self.rand:
-            X = X_nat_np + np.random.uniform(-self.epsilon, self.epsilon,
-                X_nat_np.shape).astype('float32')
+            X = X_nat_np + np.array([rng.uniform(-self.epsilon, self.epsilon,
+                X_nat_np.shape[1:]) for rng in rngs]).astype('float32')
         else:
             X = np.copy(X_nat_np)
-        
+
+        # attack state stays on the device, only the result is copied back.
+        X_var = torch.from_numpy(X).to(self.device).requires_grad_()
+        y_var = y.to(self.device)
+        # epsilon ball and valid pixel range folded into one pair of bounds.
+        X_nat_var = X_nat.to(self.device)
+        lower_var = torch.clamp(X_nat_var - self.epsilon, 0, 1)
+        upper_var = torch.clamp(X_nat_var + self.epsilon, 0, 1)
+        del X_nat_var
+
         for _ in range(self.k):
-            X_var = Variable(torch.from_numpy(X).cuda(), requires_grad=True, volatile=False)
-            y_var = y.cuda()
-            scores = self.model(X_var)
+            scores = self.execution(self.model, X_var)
             
             loss = self.loss_fn(scores, y_var)
             self.model.zero_grad()
             loss.backward()
-            grad = X_var.grad.data.cpu().numpy()
-            X_var.grad.zero_()
 
-            X += self.a * np.sign(grad)
-            X = np.clip(X, X_nat_np - self.epsilon, X_nat_np + self.epsilon)
-            X = np.clip(X, 0, 1) # ensure valid pixel range
-        return torch.from_numpy(X)
\ No newline at end of file
+            with torch.no_grad():
+                X_var.add_(self.a * X_var.grad.sign_())
+                torch.min(X_var, upper_var, out=X_var)
+                torch.max(X_var, lower_var, out=X_var)
+            X_var.grad.zero_()
+        return X_var.detach().cpu()
\ No newline at end of file
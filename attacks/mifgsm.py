@@ -1,60 +1,78 @@
-import copy
 import numpy as np
 from torch.autograd import Variable
 import torch
 
+from utils.torch_utils import ModelExecution
+
 import pdb
 
 class MomentumIteratorAttack(object):
     def __init__(self, model, decay_factor=1, epsilon=0.3, steps=40, step_size=0.01, 
-        random_start=False):
+        random_start=False, device='cuda', precision='fp32', channels_last=False):
         """
         The Momentum Iterative Fast Gradient Sign Method (Dong et al. 2017).
         This method won the first places in NIPS 2017 Non-targeted Adversarial
         Attacks and Targeted Adversarial Attacks. The original paper used
         hard labels for this attack; no label smoothing. inf norm.
         Paper link: https://arxiv.org/pdf/1710.06081.pdf
+        precision and channels_last: see utils.torch_utils.ModelExecution.
         """
 
         self.epsilon = epsilon
         self.steps = steps
         self.step_size = step_size
         self.rand = random_start
-        self.model = copy.deepcopy(model)
-        self.loss_fn = torch.nn.CrossEntropyLoss().cuda()
+        self.execution = ModelExecution(device, precision, channels_last)
+        self.device = self.execution.device
+        self.model = self.execution.prepare(model)
+        # summed so that every sample gets the gradient it would get alone.
+        self.loss_fn = torch.nn.CrossEntropyLoss(reduction='sum')
         self.decay_factor = decay_factor
 
-    def __call__(self, X_nat, y):
+    def __call__(self, X_nat, y, seeds=None):
         """
         Given examples (X_nat, y), returns adversarial
         examples within epsilon of X_nat in l_infinity norm.
+        y holds one label per sample. seeds optionally gives one random
+        seed per sample, a batch then gives the same result as attacking
+        its samples one at a time with the same seeds.
         """
         X_nat_np = X_nat.numpy()
         for p in self.model.parameters():
             p.requires_grad = False
         
         self.model.eval()
+        rngs = [np.random.RandomState(seed) for seed in seeds] if seeds is not None else [np.random] * len(X_nat_np)
         if self.rand:
-            X = X_nat_np + np.random.uniform(-self.epsilon, self.epsilon,
-                X_nat_np.shape).astype('float32')
+            X = X_nat_np + np.array([rng.uniform(-self.epsilon, self.epsilon,
+                X_nat_np.shape[1:]) for rng in rngs]).astype('float32')
         else:
             X = np.copy(X_nat_np)
-        
-        momentum = 0
+
+        # attack state stays on the device, only the result is copied back.
+        X_var = torch.from_numpy(X).to(self.device).requires_grad_()
+        y_var = y.to(self.device)
+        momentum = torch.zeros_like(X_var)
+        # epsilon ball and valid pixel range folded into one pair of bounds.
+        X_nat_var = X_nat.to(self.device)
+        lower_var = torch.clamp(X_nat_var - self.epsilon, 0, 1)
+        upper_var = torch.clamp(X_nat_var + self.epsilon, 0, 1)
+        del X_nat_var
+
         for _ in range(self.steps):
-            X_var = Variable(torch.from_numpy(X).cuda(), requires_grad=True, volatile=False)
-            y_var = y.cuda()
-            scores = self.model(X_var)
+            scores = self.execution(self.model, X_var)
             
             loss = self.loss_fn(scores, y_var)
             self.model.zero_grad()
             loss.backward()
-            grad = X_var.grad.data.cpu().numpy()
-            X_var.grad.zero_()
-            velocity = grad / np.sum(np.absolute(grad))
-            momentum = self.decay_factor * momentum + velocity
 
-            X += self.step_size * np.sign(momentum)
-            X = np.clip(X, X_nat_np - self.epsilon, X_nat_np + self.epsilon)
-            X = np.clip(X, 0, 1)
-        return torch.from_numpy(X)
\ No newline at end of file
+            with torch.no_grad():
+                grad = X_var.grad
+                velocity = grad.div_(grad.abs().sum(dim=(1, 2, 3), keepdim=True))
+                momentum.mul_(self.decay_factor).add_(velocity)
+
+                X_var.add_(self.step_size * momentum.sign())
+                torch.min(X_var, upper_var, out=X_var)
+                torch.max(X_var, lower_var, out=X_var)
+            X_var.grad.zero_()
+        return X_var.detach().cpu()
\ No newline at end of file
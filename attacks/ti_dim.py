@@ -1,10 +1,11 @@
-import copy
 import numpy as np
 from torch.autograd import Variable
 import torch
 import scipy.stats as st
 from scipy import ndimage
 
+from utils.torch_utils import ModelExecution
+
 import pdb
 
 
@@ -13,17 +14,25 @@ class TIDIM_Attack(object):
                        decay_factor=1, prob=0.5,
                        epsilon=0.3, steps=40, step_size=0.01, 
                        image_resize=330,
-                       random_start=False):
+                       random_start=False,
+                       separable_kernel=False,
+                       device='cuda', precision='fp32', channels_last=False):
         """
         Paper link: https://arxiv.org/pdf/1803.06978.pdf
+        separable_kernel smooths the gradient with two 1-D passes instead of
+        the 15x15 kernel, which is equivalent since the Gaussian is rank-1.
+        precision and channels_last: see utils.torch_utils.ModelExecution.
         """
 
         self.epsilon = epsilon
         self.steps = steps
         self.step_size = step_size
         self.rand = random_start
-        self.model = copy.deepcopy(model)
-        self.loss_fn = torch.nn.CrossEntropyLoss().cuda()
+        self.execution = ModelExecution(device, precision, channels_last)
+        self.device = self.execution.device
+        self.model = self.execution.prepare(model)
+        # summed so that every sample gets the gradient it would get alone.
+        self.loss_fn = torch.nn.CrossEntropyLoss(reduction='sum')
         self.decay_factor = decay_factor
         self.prob = prob
         self.image_resize = image_resize
@@ -31,49 +40,77 @@ class TIDIM_Attack(object):
         kernel = self.gkern(15, 3).astype(np.float32)
         self.stack_kernel = np.stack([kernel, kernel, kernel])
 
-    def __call__(self, X_nat, y):
+        self.separable_kernel = separable_kernel
+        self.kernel_pad = kernel.shape[-1] // 2
+        kernel_1d = self.gkern1d(15, 3).astype(np.float32)
+        # ndimage.convolve with the (3, 15, 15) stack also sums each channel
+        # with its neighbours (zero padded), reproduced by channel_mix.
+        channel_mix = np.tri(3, 3, 1) - np.tri(3, 3, -2)
+        self.smoothing_kernels = {
+            'channel_mix' : torch.from_numpy(channel_mix.astype(np.float32)).view(3, 3, 1, 1),
+            'kernel' : torch.from_numpy(kernel).expand(3, 1, 15, 15).contiguous(),
+            'kernel_row' : torch.from_numpy(kernel_1d).view(1, 1, 1, 15).expand(3, 1, 1, 15).contiguous(),
+            'kernel_col' : torch.from_numpy(kernel_1d).view(1, 1, 15, 1).expand(3, 1, 15, 1).contiguous(),
+        }
+
+    def __call__(self, X_nat, y, seeds=None):
         """
         Given examples (X_nat, y), returns adversarial
         examples within epsilon of X_nat in l_infinity norm.
+        y holds one label per sample. seeds optionally gives one random
+        seed per sample, a batch then gives the same result as attacking
+        its samples one at a time with the same seeds.
         """
         X_nat_np = X_nat.numpy()
         for p in self.model.parameters():
             p.requires_grad = False
         
         self.model.eval()
+        rngs = [np.random.RandomState(seed) for seed in seeds] if seeds is not None else [np.random] * len(X_nat_np)
         if self.rand:
-            X = X_nat_np + np.random.uniform(-self.epsilon, self.epsilon,
-                X_nat_np.shape).astype('float32')
+            X = X_nat_np + np.array([rng.uniform(-self.epsilon, self.epsilon,
+                X_nat_np.shape[1:]) for rng in rngs]).astype('float32')
         else:
             X = np.copy(X_nat_np)
-        
-        momentum = 0
-        for _ in range(self.steps):
-            X_var = Variable(torch.from_numpy(X).cuda(), requires_grad=True, volatile=False)
-            y_var = y.cuda()
 
-            rnd = np.random.rand()
-            if rnd < self.prob:
-                transformer = _tranform_resize_padding(X.shape[-2], X.shape[-1], self.image_resize, resize_back=True)
-                X_trans_var = transformer(X_var)
-            else:
-                X_trans_var = X_var
+        # attack state stays on the device, only the result is copied back.
+        X_var = torch.from_numpy(X).to(self.device).requires_grad_()
+        y_var = y.to(self.device)
+        momentum = torch.zeros_like(X_var)
+        # epsilon ball and valid pixel range folded into one pair of bounds.
+        X_nat_var = X_nat.to(self.device)
+        lower_var = torch.clamp(X_nat_var - self.epsilon, 0, 1)
+        upper_var = torch.clamp(X_nat_var + self.epsilon, 0, 1)
+        del X_nat_var
 
-            scores = self.model(X_trans_var)
+        for _ in range(self.steps):
+            # input diversity is drawn independently for every sample.
+            transformer = _tranform_resize_padding(X.shape[-2], X.shape[-1], self.image_resize, resize_back=True)
+            X_trans_list = []
+            for idx, rng in enumerate(rngs):
+                X_sample_var = X_var[idx:idx + 1]
+                rnd = rng.rand()
+                if rnd < self.prob:
+                    X_sample_var = transformer(X_sample_var, rng=rng)
+                X_trans_list.append(X_sample_var)
+            X_trans_var = torch.cat(X_trans_list)
+
+            scores = self.execution(self.model, X_trans_var)
             
             loss = self.loss_fn(scores, y_var)
             self.model.zero_grad()
             loss.backward()
-            grad = X_var.grad.data.cpu().numpy()
-            grad = self.depthwise_conv2d(grad, self.stack_kernel)
-            X_var.grad.zero_()
-            velocity = grad / np.mean(np.absolute(grad), axis=(1, 2, 3))
-            momentum = self.decay_factor * momentum + velocity
 
-            X += self.step_size * np.sign(momentum)
-            X = np.clip(X, X_nat_np - self.epsilon, X_nat_np + self.epsilon)
-            X = np.clip(X, 0, 1) # ensure valid pixel range
-        return torch.from_numpy(X)
+            with torch.no_grad():
+                grad = self.smooth_gradient(X_var.grad)
+                velocity = grad.div_(grad.abs().mean(dim=(1, 2, 3), keepdim=True))
+                momentum.mul_(self.decay_factor).add_(velocity)
+
+                X_var.add_(self.step_size * momentum.sign())
+                torch.min(X_var, upper_var, out=X_var)
+                torch.max(X_var, lower_var, out=X_var)
+            X_var.grad.zero_()
+        return X_var.detach().cpu()
 
     @staticmethod
     def gkern(kernlen, nsig):
@@ -84,6 +121,29 @@ class TIDIM_Attack(object):
         kernel = kernel_raw / kernel_raw.sum()
         return kernel
 
+    @staticmethod
+    def gkern1d(kernlen, nsig):
+        """Returns the 1D factor of gkern, gkern == np.outer(gkern1d, gkern1d)."""
+        x = np.linspace(-nsig, nsig, kernlen)
+        kern1d = st.norm.pdf(x)
+        return kern1d / kern1d.sum()
+
+    def smooth_gradient(self, grad):
+        """Device version of depthwise_conv2d(grad, self.stack_kernel)."""
+        for key, kernel in self.smoothing_kernels.items():
+            if kernel.device != grad.device:
+                self.smoothing_kernels[key] = kernel.to(grad.device)
+        kernels = self.smoothing_kernels
+        pad = self.kernel_pad
+
+        grad = torch.nn.functional.conv2d(grad, kernels['channel_mix'])
+        if self.separable_kernel:
+            grad = torch.nn.functional.conv2d(grad, kernels['kernel_row'], padding=(0, pad), groups=3)
+            grad = torch.nn.functional.conv2d(grad, kernels['kernel_col'], padding=(pad, 0), groups=3)
+        else:
+            grad = torch.nn.functional.conv2d(grad, kernels['kernel'], padding=pad, groups=3)
+        return grad
+
     @staticmethod
     def depthwise_conv2d(in1, stack_kernel):
         ret = []
@@ -103,15 +163,15 @@ class _tranform_resize_padding(torch.nn.Module):
         self.image_resize = image_resize
         self.resize_back = resize_back
 
-    def __call__(self, input_tensor):
+    def __call__(self, input_tensor, rng=np.random):
         assert self.shape[0] < self.image_resize and self.shape[1] < self.image_resize
-        rnd = np.random.randint(self.shape[1], self.image_resize)
+        rnd = rng.randint(self.shape[1], self.image_resize)
         input_upsample = torch.nn.functional.interpolate(input_tensor, size=(rnd, rnd), mode='nearest')
         h_rem = self.image_resize - rnd
         w_rem = self.image_resize - rnd
-        pad_top = np.random.randint(0, h_rem)
+        pad_top = rng.randint(0, h_rem)
         pad_bottom = h_rem - pad_top
-        pad_left = np.random.randint(0, w_rem)
+        pad_left = rng.randint(0, w_rem)
         pad_right = w_rem - pad_left
         padder = torch.nn.ConstantPad2d((pad_left, pad_right, pad_top, pad_bottom), 0.0)
         input_padded = padder(input_upsample)
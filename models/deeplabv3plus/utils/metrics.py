@@ -1,10 +1,28 @@
 import numpy as np
+import torch
 
 
 class Evaluator(object):
+    """Confusion matrix based segmentation metrics.
+
+    add_batch takes numpy label maps, or torch tensors of label maps or
+    (N, C, H, W) logits. Tensor batches are argmax-ed and counted on their
+    device, the counts are only copied to the host when a metric or
+    confusion_matrix is read.
+    """
     def __init__(self, num_class):
         self.num_class = num_class
-        self.confusion_matrix = np.zeros((self.num_class,)*2)
+        self.reset()
+
+    @property
+    def confusion_matrix(self):
+        self._flush_device_matrix()
+        return self._confusion_matrix
+
+    @confusion_matrix.setter
+    def confusion_matrix(self, confusion_matrix):
+        self._confusion_matrix = confusion_matrix
+        self._device_matrix = None
 
     def Pixel_Accuracy(self):
         Acc = np.diag(self.confusion_matrix).sum() / self.confusion_matrix.sum()
@@ -38,10 +56,51 @@ class Evaluator(object):
         confusion_matrix = count.reshape(self.num_class, self.num_class)
         return confusion_matrix
 
+    def _generate_matrix_torch(self, gt_image, pre_image):
+        mask = (gt_image >= 0) & (gt_image < self.num_class)
+        label = self.num_class * gt_image[mask].long() + pre_image[mask].long()
+        count = torch.bincount(label, minlength=self.num_class**2)
+        confusion_matrix = count.view(self.num_class, self.num_class)
+        return confusion_matrix
+
+    def _to_label_tensor(self, image, device):
+        image = torch.as_tensor(image, device=device)
+        if image.is_floating_point() and image.dim() == 4:
+            image = image.argmax(dim=1)
+        return image
+
     def add_batch(self, gt_image, pre_image):
+        if torch.is_tensor(gt_image) or torch.is_tensor(pre_image):
+            device = gt_image.device if torch.is_tensor(gt_image) else pre_image.device
+            with torch.no_grad():
+                gt_image = self._to_label_tensor(gt_image, device)
+                pre_image = self._to_label_tensor(pre_image, device)
+                assert gt_image.shape == pre_image.shape
+                confusion_matrix = self._generate_matrix_torch(gt_image, pre_image)
+                if self._device_matrix is not None and self._device_matrix.device != device:
+                    self._flush_device_matrix()
+                if self._device_matrix is None:
+                    self._device_matrix = confusion_matrix
+                else:
+                    self._device_matrix += confusion_matrix
+            return
         assert gt_image.shape == pre_image.shape
         self.confusion_matrix += self._generate_matrix(gt_image, pre_image)
 
+    def _flush_device_matrix(self):
+        if self._device_matrix is not None:
+            self._confusion_matrix += self._device_matrix.cpu().numpy()
+            self._device_matrix = None
+
+    def merge(self, *others):
+        """add the counts of other Evaluators or confusion matrices,
+        e.g. the partial results of parallel workers."""
+        for other in others:
+            if isinstance(other, Evaluator):
+                other = other.confusion_matrix
+            self.confusion_matrix += other
+        return self
+
     def reset(self):
         self.confusion_matrix = np.zeros((self.num_class,) * 2)
 
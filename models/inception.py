@@ -1,5 +1,8 @@
 import torchvision.models as models
 import torch
+
+from utils.torch_utils import forward_with_internals, TruncatedModel
+
 import pdb
 
 class Inception_v3(torch.nn.Module):
@@ -8,30 +11,51 @@ class Inception_v3(torch.nn.Module):
         B : 8
         C : 9, 10, 11, 12
     '''
-    def __init__(self):
+    def __init__(self, device='cuda', pretrained=True):
         super(Inception_v3, self).__init__()
-        self.model = models.inception_v3(pretrained=True).cuda().eval()
+        self.model = models.inception_v3(pretrained=pretrained).to(device).eval()
         features = list(self.model.children())
         #print(len(features))
         #for ii, model in enumerate(features):
         #    print(ii, model)
         self.features = torch.nn.ModuleList(features)
 
-    def prediction(self, x, internal=[]):
-        pred = self.model(x)
-        hit_cnt = 0
+    def prediction(self, x, internal=[], with_pred=True):
         if len(internal) == 0:
-            return pred
-        
-        layers = []
-        for ii, model in enumerate(self.features):
-            x = model(x)
-            if(ii in internal):
-                hit_cnt += 1
-                layers.append(x)
-            if(hit_cnt==len(internal)):
+            return self.model(x)
+        if not self.model.training:
+            # AuxLogits is only run by the model in training mode.
+            aux_idx = list(self.features).index(self.model.AuxLogits)
+            internal = [ii for ii in internal if ii != aux_idx]
+        return forward_with_internals(self.model, self.features, x, internal, with_pred=with_pred)
+
+    def truncate(self, layer_idx_list):
+        '''Rebuild the forward pass of the model up to the deepest layer,
+        including the input transform and the functional max pools that do
+        not show up in children().
+        '''
+        last_idx = max(layer_idx_list)
+        stages = []
+        if self.model.transform_input:
+            stages.append((None, _TransformInput()))
+        for ii, (name, model) in enumerate(self.model.named_children()):
+            if ii > last_idx:
                 break
-        return layers, pred
+            if name == 'AuxLogits':
+                continue
+            assert name != 'fc'
+            stages.append((ii, model))
+            if name in ['Conv2d_2b_3x3', 'Conv2d_4a_3x3'] and not hasattr(self.model, 'maxpool1'):
+                stages.append((None, torch.nn.MaxPool2d(kernel_size=3, stride=2)))
+        return TruncatedModel(stages, layer_idx_list)
+
+
+class _TransformInput(torch.nn.Module):
+    def forward(self, x):
+        x_ch0 = torch.unsqueeze(x[:, 0], 1) * (0.229 / 0.5) + (0.485 - 0.5) / 0.5
+        x_ch1 = torch.unsqueeze(x[:, 1], 1) * (0.224 / 0.5) + (0.456 - 0.5) / 0.5
+        x_ch2 = torch.unsqueeze(x[:, 2], 1) * (0.225 / 0.5) + (0.406 - 0.5) / 0.5
+        return torch.cat((x_ch0, x_ch1, x_ch2), 1)
 
 if __name__ == "__main__":
     Inception_v3()
\ No newline at end of file
@@ -1,32 +1,33 @@
 import torchvision.models as models
 import torch
+
+from utils.torch_utils import forward_with_internals, stop_module_idx, TruncatedModel
+
 import pdb
 
 class Resnet152(torch.nn.Module):
-    def __init__(self):
+    def __init__(self, device='cuda', pretrained=True):
         super(Resnet152, self).__init__()
-        self.model = models.resnet152(pretrained=True).cuda().eval()
+        self.model = models.resnet152(pretrained=pretrained).to(device).eval()
         features = list(self.model.children())
         #print(len(features))
         #for ii, model in enumerate(features):
         #    print(ii, model)
         self.features = torch.nn.ModuleList(features)
 
-    def prediction(self, x, internal=[]):
-        pred = self.model(x)
-        hit_cnt = 0
+    def prediction(self, x, internal=[], with_pred=True):
         if len(internal) == 0:
-            return pred
-        
-        layers = []
-        for ii, model in enumerate(self.features):
-            x = model(x)
-            if(ii in internal):
-                hit_cnt += 1
-                layers.append(x)
-            if(hit_cnt==len(internal)):
-                break
-        return layers, pred
+            return self.model(x)
+        return forward_with_internals(self.model, self.features, x, internal, with_pred=with_pred)
+
+    def truncate(self, layer_idx_list):
+        last_idx = max(layer_idx_list)
+        # fc needs the flattened avgpool output, it cannot be a plain stage.
+        assert last_idx < len(self.features) - 1
+        # runs the in-place ReLU after the last layer too, like the full pass.
+        stop_idx = stop_module_idx(self.features, last_idx)
+        stages = [(ii, model) for ii, model in enumerate(self.features) if ii <= stop_idx]
+        return TruncatedModel(stages, layer_idx_list)
 
 if __name__ == "__main__":
     Resnet152()
\ No newline at end of file
@@ -19,6 +19,7 @@ from models.retina_resnet50.retinanet_resnet_50.utils.image import preprocess_im
 from models.retina_resnet50.retinanet_resnet_50 import models
 import numpy as np
 import tensorflow as tf
+import itertools
 import pdb
 
 
@@ -92,13 +93,16 @@ class KerasResNet50RetinaNetModel():
             image_np = image_input
         return self.batch_predictions(np.expand_dims(image_np, axis=0))[0]
 
-    def batch_predictions(self, images):
+    def batch_predictions(self, images, scales=None):
         """Batch prediction of images.
 
         Parameters
         ----------
         images : `numpy.ndarray`
             The input image in [b, h, w, c] ndarry format.
+        scales : list of float, optional
+            Per image resize scale returned by `resize_image`, the boxes
+            are divided by it to map them back to the original image.
 
         Returns
         -------
@@ -108,27 +112,55 @@ class KerasResNet50RetinaNetModel():
             {'boxes', 'scores', 'classes}
         """
         boxes_list, scores_list, labels_list = self._model.predict(images)
-        results = []
+        # [x1, y1, x2, y2] -> [y1, x1, y2, x2]
+        boxes_list = boxes_list[..., [1, 0, 3, 2]]
+        if scales is not None:
+            boxes_list = boxes_list / np.asarray(
+                scales, dtype=boxes_list.dtype).reshape(-1, 1, 1)
+        keep_list = scores_list >= self._th_conf
 
-        for boxes, scores, labels in zip(boxes_list,
-                                         scores_list,
-                                         labels_list):
+        results = []
+        for boxes, scores, labels, keep in zip(boxes_list,
+                                               scores_list,
+                                               labels_list,
+                                               keep_list):
             result = {}
-            out_boxes = []
-            out_scores = []
-            out_classes = []
-            for temp_box, temp_score, temp_class in zip(boxes,
-                                                        scores,
-                                                        labels):
-                if temp_score >= self._th_conf:
-                    temp_box = np.array(
-                        [temp_box[1], temp_box[0], temp_box[3], temp_box[2]])
-                    out_boxes.append(temp_box)
-                    out_scores.append(temp_score)
-                    out_classes.append(temp_class)
-            result['boxes'] = out_boxes
-            result['scores'] = out_scores
-            result['classes'] = out_classes
+            result['boxes'] = list(boxes[keep])
+            result['scores'] = list(scores[keep])
+            result['classes'] = list(labels[keep])
             results.append(result)
 
-        return results
\ No newline at end of file
+        return results
+
+    def iter_batch_predictions(self, images, scales=None, batch_size=8):
+        """Stream the predictions of a long sequence of images.
+
+        Parameters
+        ----------
+        images : iterable of `numpy.ndarray`
+            Images in [h, w, c] format, all of the same size.
+        scales : iterable of float, optional
+            Per image resize scale, see `batch_predictions`.
+        batch_size : int
+            Number of images run through the model at a time.
+
+        Yields
+        ------
+        dict
+            The prediction of each image, in input order.
+        """
+        if scales is None:
+            scales = itertools.repeat(1.)
+        batch_images = []
+        batch_scales = []
+        for image, scale in zip(images, scales):
+            batch_images.append(image)
+            batch_scales.append(scale)
+            if len(batch_images) == batch_size:
+                yield from self.batch_predictions(
+                    np.stack(batch_images), scales=batch_scales)
+                batch_images = []
+                batch_scales = []
+        if len(batch_images) > 0:
+            yield from self.batch_predictions(
+                np.stack(batch_images), scales=batch_scales)
\ No newline at end of file
@@ -11,18 +11,69 @@ import numpy as np
 
 def compute_overlap(
     boxes,
-    query_boxes
+    query_boxes,
+    block_size=None
 ):
     """
     Args
         a: (N, 4) ndarray of float
         b: (K, 4) ndarray of float
+        block_size: if set, boxes are processed block_size rows at a time,
+            bounding the temporaries to (block_size, K) arrays.
 
     Returns
         overlaps: (N, K) ndarray of overlap between boxes and query_boxes
     """
     N = boxes.shape[0]
     K = query_boxes.shape[0]
+    if block_size is None or block_size >= N:
+        return _compute_overlap_block(boxes, query_boxes)
+    overlaps = np.zeros((N, K), dtype=np.float64)
+    for start in range(0, N, block_size):
+        overlaps[start:start + block_size] = _compute_overlap_block(
+            boxes[start:start + block_size], query_boxes)
+    return overlaps
+
+
+def _compute_overlap_block(
+    boxes,
+    query_boxes
+):
+    """Broadcasting (N, K) overlaps, same arithmetic as the scalar loop."""
+    query_area = (
+        (query_boxes[:, 2] - query_boxes[:, 0] + 1) *
+        (query_boxes[:, 3] - query_boxes[:, 1] + 1)
+    )
+    boxes_area = (
+        (boxes[:, 2] - boxes[:, 0] + 1) *
+        (boxes[:, 3] - boxes[:, 1] + 1)
+    )
+    iw = (
+        np.minimum(boxes[:, 2:3], query_boxes[:, 2]) -
+        np.maximum(boxes[:, 0:1], query_boxes[:, 0]) + 1
+    )
+    ih = (
+        np.minimum(boxes[:, 3:4], query_boxes[:, 3]) -
+        np.maximum(boxes[:, 1:2], query_boxes[:, 1]) + 1
+    )
+    intersection = iw * ih
+    ua = (boxes_area[:, None] + query_area - intersection).astype(np.float64)
+    overlaps = np.zeros(intersection.shape, dtype=np.float64)
+    mask = (iw > 0) & (ih > 0)
+    overlaps[mask] = intersection[mask] / ua[mask]
+    return overlaps
+
+
+def _compute_overlap_loop(
+    boxes,
+    query_boxes
+):
+    """
+    Scalar loop port of the Cython routine, kept as the reference of
+    compute_overlap.
+    """
+    N = boxes.shape[0]
+    K = query_boxes.shape[0]
     overlaps = np.zeros((N, K), dtype=np.float64)
     for k in range(K):
         box_area = (
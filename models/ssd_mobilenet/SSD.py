@@ -7,12 +7,121 @@ from glob import glob
 
 import pdb
 
+CATEGORY_INDEX = {1: {'id': 1, 'name': 'person'},
+                  2: {'id': 2, 'name': 'bicycle'},
+                  3: {'id': 3, 'name': 'car'},
+                  4: {'id': 4, 'name': 'motorcycle'},
+                  5: {'id': 5, 'name': 'airplane'},
+                  6: {'id': 6, 'name': 'bus'},
+                  7: {'id': 7, 'name': 'train'},
+                  8: {'id': 8, 'name': 'truck'},
+                  9: {'id': 9, 'name': 'boat'},
+                  10: {'id': 10, 'name': 'traffic light'},
+                  11: {'id': 11, 'name': 'fire hydrant'},
+                  13: {'id': 13, 'name': 'stop sign'},
+                  14: {'id': 14, 'name': 'parking meter'}}
+
+COCO_91CLASS = {
+    0 : '__background__',
+    1 : 'person',
+    2 : 'bicycle',
+    3 : 'car',
+    4 : 'motorcycle',
+    5 : 'airplane',
+    6 : 'bus',
+    7 : 'train',
+    8 : 'truck',
+    9 : 'boat',
+    10 : 'traffic light',
+    11 : 'fire hydrant',
+    12 : 'street sign N/A',
+    13 : 'stop sign',
+    14 : 'parking meter',
+    15 : 'bench',
+    16 : 'bird',
+    17 : 'cat',
+    18 : 'dog',
+    19 : 'horse',
+    20 : 'sheep',
+    21 : 'cow',
+    22 : 'elephant',
+    23 : 'bear',
+    24 : 'zebra',
+    25 : 'giraffe',
+    26 : 'hat N/A',
+    27 : 'backpack',
+    28 : 'umbrella',
+    29 : 'shoe N/A',
+    30 : 'eye glasses N/A',
+    31 : 'handbag',
+    32 : 'tie',
+    33 : 'suitcase',
+    34 : 'frisbee',
+    35 : 'skis',
+    36 : 'snowboard',
+    37 : 'sports ball',
+    38 : 'kite',
+    39 : 'baseball bat',
+    40 : 'baseball glove',
+    41 : 'skateboard',
+    42 : 'surfboard',
+    43 : 'tennis racket',
+    44 : 'bottle',
+    45 : 'plate N/A',
+    46 : 'wine glass',
+    47 : 'cup',
+    48 : 'fork',
+    49 : 'knife',
+    50 : 'spoon',
+    51 : 'bowl',
+    52 : 'banana',
+    53 : 'apple',
+    54 : 'sandwich',
+    55 : 'orange',
+    56 : 'broccoli',
+    57 : 'carrot',
+    58 : 'hot dog',
+    59 : 'pizza',
+    60 : 'donut',
+    61 : 'cake',
+    62 : 'chair',
+    63 : 'couch',
+    64 : 'potted plant',
+    65 : 'bed',
+    66 : 'mirror N/A',
+    67 : 'dining table',
+    68 : 'window N/A',
+    69 : 'desk N/A',
+    70 : 'toilet',
+    71 : 'door N/A',
+    72 : 'tv',
+    73 : 'laptop',
+    74 : 'mouse',
+    75 : 'remote',
+    76 : 'keyboard',
+    77 : 'cell phone',
+    78 : 'microwave',
+    79 : 'oven',
+    80 : 'toaster',
+    81 : 'sink',
+    82 : 'refrigerator',
+    83 : 'blender N/A',
+    84 : 'book',
+    85 : 'clock',
+    86 : 'vase',
+    87 : 'scissors',
+    88 : 'teddy bear',
+    89 : 'hair drier',
+    90 : 'toothbrush'
+}
+
 class SSD_detector(object):
     def __init__(self):
         
         detect_model_name = 'models/ssd_mobilenet/ssd_mobilenet_v1_coco_11_06_2017'
         
         PATH_TO_CKPT = detect_model_name + '/frozen_inference_graph.pb'
+        self.model_path = PATH_TO_CKPT
         
         # setup tensorflow graph
         self.detection_graph = tf.Graph()
@@ -39,11 +148,9 @@ class SSD_detector(object):
             self.classes = self.detection_graph.get_tensor_by_name('detection_classes:0')
             self.num_detections =self.detection_graph.get_tensor_by_name('num_detections:0')
     
-    # Helper function to convert image into numpy array    
+    # Helper function to convert image into numpy array
     def load_image_into_numpy_array(self, image):
-         (im_width, im_height) = image.size
-         return np.array(image.getdata()).reshape(
-            (im_height, im_width, 3)).astype(np.uint8)       
+        return np.asarray(image, dtype=np.uint8)
     # Helper function to convert normalized box coordinates to pixels
     def box_normal_to_pixel(self, box, dim):
     
@@ -63,20 +170,60 @@ class SSD_detector(object):
             'class_names' : [str, ...]
         }
         '''
-        image_np = np.array(image_pil).astype(float)
-        det_res = self.detect_image(image_np) 
-        ret_dic = {
-            'boxes' : [],
-            'scores' : [],
-            'classes' : [],
-            'class_names' : []
-        }
-        for temp_det in det_res:
-            ret_dic['boxes'].append(temp_det['bbox'].tolist())
-            ret_dic['scores'].append(temp_det['score'])
-            ret_dic['classes'].append(temp_det['class_idx'])
-            ret_dic['class_names'].append(temp_det['class_name'])
-        return ret_dic
+        return self.predict_batch([image_pil])[0]
+
+    def predict_batch(self, images, th_conf=0.3):
+        '''
+        predict a list of PIL images or uint8 arrays of shape (H, W, 3).
+
+        Images of the same size share one sess.run.
+
+        Output:
+            list of dictionary of list, one per image, same as predict.
+        '''
+        images_np = [image if isinstance(image, np.ndarray) else self.load_image_into_numpy_array(image) for image in images]
+        shape_groups = {}
+        for idx, image_np in enumerate(images_np):
+            shape_groups.setdefault(image_np.shape, []).append(idx)
+
+        ret_list = [None] * len(images_np)
+        for shape, idx_list in shape_groups.items():
+            batch_np = np.stack([images_np[idx] for idx in idx_list]).astype(np.uint8, copy=False)
+            det_res_list = self.detect_batch(batch_np, th_conf=th_conf)
+            for idx, det_res in zip(idx_list, det_res_list):
+                ret_list[idx] = det_res
+        return ret_list
+
+    def detect_batch(self, images_np, th_conf=0.3):
+        '''
+        run one batch of uint8 images of the same size, (N, H, W, 3).
+
+        Output:
+            list of dictionary of list, one per image, same as predict.
+        '''
+        with self.detection_graph.as_default():
+            (boxes, scores, classes, num_detections) = self.sess.run(
+                [self.boxes, self.scores, self.classes, self.num_detections],
+                feed_dict={self.image_tensor: images_np})
+
+        height, width = images_np.shape[1:3]
+        # scaled in float64 like the former int(box[i] * height), a float32
+        # product can round up to the next integer.
+        scale = np.array([height, width, height, width], dtype=np.float64)
+        boxes_pixel = (boxes.astype(np.float64) * scale).astype(int)
+        classes = classes.astype(int)
+        keep = scores > th_conf
+
+        ret_list = []
+        for temp_boxes, temp_scores, temp_classes, temp_keep in zip(boxes_pixel, scores, classes, keep):
+            temp_classes = temp_classes[temp_keep].tolist()
+            ret_list.append({
+                'boxes' : temp_boxes[temp_keep].tolist(),
+                'scores' : list(temp_scores[temp_keep]),
+                'classes' : temp_classes,
+                'class_names' : [CATEGORY_INDEX[temp_class]['name'] if temp_class in CATEGORY_INDEX else 'None' for temp_class in temp_classes]
+            })
+        return ret_list
         
     def detect_image(self, image, th_conf=0.3):  
         
@@ -97,139 +244,13 @@ class SSD_detector(object):
         ]
 
         """
-        category_index={1: {'id': 1, 'name': 'person'},
-                        2: {'id': 2, 'name': 'bicycle'},
-                        3: {'id': 3, 'name': 'car'},
-                        4: {'id': 4, 'name': 'motorcycle'},
-                        5: {'id': 5, 'name': 'airplane'},
-                        6: {'id': 6, 'name': 'bus'},
-                        7: {'id': 7, 'name': 'train'},
-                        8: {'id': 8, 'name': 'truck'},
-                        9: {'id': 9, 'name': 'boat'},
-                        10: {'id': 10, 'name': 'traffic light'},
-                        11: {'id': 11, 'name': 'fire hydrant'},
-                        13: {'id': 13, 'name': 'stop sign'},
-                        14: {'id': 14, 'name': 'parking meter'}}  
-
-        coco_91class = {
-            0 : '__background__',
-            1 : 'person',
-            2 : 'bicycle',
-            3 : 'car',
-            4 : 'motorcycle',
-            5 : 'airplane',
-            6 : 'bus',
-            7 : 'train',
-            8 : 'truck',
-            9 : 'boat',
-            10 : 'traffic light',
-            11 : 'fire hydrant',
-            12 : 'street sign N/A',
-            13 : 'stop sign',
-            14 : 'parking meter',
-            15 : 'bench',
-            16 : 'bird',
-            17 : 'cat',
-            18 : 'dog',
-            19 : 'horse',
-            20 : 'sheep',
-            21 : 'cow',
-            22 : 'elephant',
-            23 : 'bear',
-            24 : 'zebra',
-            25 : 'giraffe',
-            26 : 'hat N/A',
-            27 : 'backpack',
-            28 : 'umbrella',
-            29 : 'shoe N/A',
-            30 : 'eye glasses N/A',
-            31 : 'handbag',
-            32 : 'tie',
-            33 : 'suitcase',
-            34 : 'frisbee',
-            35 : 'skis',
-            36 : 'snowboard',
-            37 : 'sports ball',
-            38 : 'kite',
-            39 : 'baseball bat',
-            40 : 'baseball glove',
-            41 : 'skateboard',
-            42 : 'surfboard',
-            43 : 'tennis racket',
-            44 : 'bottle',
-            45 : 'plate N/A',
-            46 : 'wine glass',
-            47 : 'cup',
-            48 : 'fork',
-            49 : 'knife',
-            50 : 'spoon',
-            51 : 'bowl',
-            52 : 'banana',
-            53 : 'apple',
-            54 : 'sandwich',
-            55 : 'orange',
-            56 : 'broccoli',
-            57 : 'carrot',
-            58 : 'hot dog',
-            59 : 'pizza',
-            60 : 'donut',
-            61 : 'cake',
-            62 : 'chair',
-            63 : 'couch',
-            64 : 'potted plant',
-            65 : 'bed',
-            66 : 'mirror N/A',
-            67 : 'dining table',
-            68 : 'window N/A',
-            69 : 'desk N/A',
-            70 : 'toilet',
-            71 : 'door N/A',
-            72 : 'tv',
-            73 : 'laptop',
-            74 : 'mouse',
-            75 : 'remote',
-            76 : 'keyboard',
-            77 : 'cell phone',
-            78 : 'microwave',
-            79 : 'oven',
-            80 : 'toaster',
-            81 : 'sink',
-            82 : 'refrigerator',
-            83 : 'blender N/A',
-            84 : 'book',
-            85 : 'clock',
-            86 : 'vase',
-            87 : 'scissors',
-            88 : 'teddy bear',
-            89 : 'hair drier',
-            90 : 'toothbrush'
-        }
-        
+        det_res = self.detect_batch(np.expand_dims(np.asarray(image).astype(np.uint8, copy=False), axis=0), th_conf=th_conf)[0]
         results = []
-
-        with self.detection_graph.as_default():
-            image_expanded = np.expand_dims(image, axis=0)
-            (boxes, scores, classes, num_detections) = self.sess.run(
-                [self.boxes, self.scores, self.classes, self.num_detections],
-                feed_dict={self.image_tensor: image_expanded})
-            
-            boxes=np.squeeze(boxes)
-            classes =np.squeeze(classes)
-            scores = np.squeeze(scores)
-            for temp_box, temp_score, temp_class in zip(boxes, scores, classes):
-                temp_class = int(temp_class)
-                dim = np.array(image.shape[0:2])
-                temp_result = {}
-                if temp_score > th_conf:
-                    temp_box_resize = self.box_normal_to_pixel(temp_box, dim)
-                    box_lurd = np.array([temp_box_resize[0], temp_box_resize[1], temp_box_resize[2], temp_box_resize[3]])
-                    temp_result['bbox'] = box_lurd
-                    temp_result['score'] = temp_score
-                    temp_result['class_idx'] = temp_class
-                    try:
-                        temp_result['class_name'] = category_index[temp_class]['name']
-                    except:
-                        temp_result['class_name'] = 'None'
-                    results.append(temp_result)
-
+        for temp_box, temp_score, temp_class, temp_name in zip(det_res['boxes'], det_res['scores'], det_res['classes'], det_res['class_names']):
+            results.append({
+                'bbox' : np.array(temp_box),
+                'score' : temp_score,
+                'class_idx' : temp_class,
+                'class_name' : temp_name
+            })
         return results
\ No newline at end of file
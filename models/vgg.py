@@ -1,27 +1,27 @@
 import torchvision.models as models
 import torch
 
+from utils.torch_utils import forward_with_internals, stop_module_idx, TruncatedModel
+
 import pdb
 
 class Vgg16(torch.nn.Module):
-    def __init__(self):
+    def __init__(self, device='cuda', pretrained=True):
         super(Vgg16, self).__init__()
-        self.model = models.vgg16(pretrained=True).cuda().eval()
+        self.model = models.vgg16(pretrained=pretrained).to(device).eval()
         features = list(self.model.features)
-        self.features = torch.nn.ModuleList(features).cuda().eval()
+        self.features = torch.nn.ModuleList(features).eval()
 
-    def prediction(self, x, internal=[]):
-        pred = self.model(x)
+    def prediction(self, x, internal=[], with_pred=True):
         if len(internal) == 0:
-            return pred
-        
-        layers = []
-        for ii, model in enumerate(self.features):
-            x = model(x)
-            if(ii in internal):
-            # if isinstance(model, torch.nn.modules.conv.Conv2d):
-                layers.append(x)
-        return layers, pred
+            return self.model(x)
+        return forward_with_internals(self.model, self.features, x, internal, with_pred=with_pred)
+
+    def truncate(self, layer_idx_list):
+        # runs the in-place ReLU after the last layer too, like the full pass.
+        stop_idx = stop_module_idx(self.features, max(layer_idx_list))
+        stages = [(ii, model) for ii, model in enumerate(self.features) if ii <= stop_idx]
+        return TruncatedModel(stages, layer_idx_list)
 
 if __name__ == "__main__":
     Vgg16()
@@ -240,7 +240,7 @@ def yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape):
     box_hw = box_wh[..., ::-1]
     input_shape = K.cast(input_shape, K.dtype(box_yx)) # (416, 416)
     image_shape = K.cast(image_shape, K.dtype(box_yx)) # (416, 416)
-    new_shape = K.round(image_shape * K.min(input_shape/image_shape))
+    new_shape = K.round(image_shape * K.min(input_shape/image_shape, axis=-1, keepdims=True))
     offset = (input_shape-new_shape)/2./input_shape
     scale = input_shape/new_shape
     box_yx = (box_yx - offset) * scale # rescale to [1080, 1920]
@@ -337,6 +337,25 @@ def yolo_eval(yolo_outputs,
     box_confidence_logits = K.concatenate(box_confidence_logits, axis=0)
     box_class_probs_logits = K.concatenate(box_class_probs_logits, axis=0)
 
+    return yolo_nms(boxes, box_scores, num_classes,
+                    max_boxes=max_boxes,
+                    score_threshold=score_threshold,
+                    iou_threshold=iou_threshold)
+
+
+def yolo_nms(boxes, box_scores, num_classes,
+             max_boxes=20,
+             score_threshold=.6,
+             iou_threshold=.5):
+    """ Per class score thresholding and NMS of the boxes of one image.
+
+    Args:
+        boxes: (num_boxes, 4) boxes.
+        box_scores: (num_boxes, num_classes) class scores.
+
+    Returns:
+        boxes_, scores_, classes_ of the kept boxes, grouped by class.
+    """
     mask = box_scores >= score_threshold
     max_boxes_tensor = K.constant(max_boxes, dtype='int32')
     boxes_ = []
@@ -364,6 +383,63 @@ def yolo_eval(yolo_outputs,
     return boxes_, scores_, classes_
 
 
+def yolo_eval_batch(yolo_outputs,
+                    anchors,
+                    num_classes,
+                    image_shapes,
+                    max_boxes=20,
+                    score_threshold=.6,
+                    iou_threshold=.5):
+    """ Batched yolo_eval, each image having its own original shape.
+
+    Args:
+        yolo_outputs: model outputs of a batch of N letterboxed images.
+        image_shapes: (N, 2) tensor of ORIGINAL image shapes (height, width).
+
+    Returns:
+        boxes_, scores_, classes_ padded to (N, num_classes * max_boxes, ...)
+        and num_detections (N,), the number of valid entries of each image.
+        Valid entries are in the same order as yolo_eval.
+    """
+    num_layers = len(yolo_outputs)
+    anchor_mask = [[6, 7, 8], [3, 4, 5], [0, 1, 2]]\
+        if num_layers == 3 else [[3, 4, 5], [1, 2, 3]]
+    input_shape = K.shape(yolo_outputs[0])[1:3] * 32
+    batch_size = K.shape(yolo_outputs[0])[0]
+    # broadcast the per image shapes over (grid_h, grid_w, num_anchors).
+    image_shapes_b = K.reshape(image_shapes, [-1, 1, 1, 1, 2])
+    boxes = []
+    box_scores = []
+    for l in range(num_layers):
+        box_xy, box_wh, box_confidence, box_class_probs, _, _, _ = yolo_head(
+            yolo_outputs[l], anchors[anchor_mask[l]], num_classes, input_shape)
+        _boxes = yolo_correct_boxes(box_xy, box_wh, input_shape, image_shapes_b)
+        boxes.append(K.reshape(_boxes, [batch_size, -1, 4]))
+        box_scores.append(
+            K.reshape(box_confidence * box_class_probs, [batch_size, -1, num_classes]))
+    boxes = K.concatenate(boxes, axis=1)
+    box_scores = K.concatenate(box_scores, axis=1)
+
+    max_total = num_classes * max_boxes
+
+    def _image_nms(args):
+        image_boxes, image_box_scores = args
+        boxes_, scores_, classes_ = yolo_nms(
+            image_boxes, image_box_scores, num_classes,
+            max_boxes=max_boxes,
+            score_threshold=score_threshold,
+            iou_threshold=iou_threshold)
+        num_detections = K.shape(scores_)[0]
+        pad = max_total - num_detections
+        boxes_ = tf.pad(boxes_, [[0, pad], [0, 0]])
+        scores_ = tf.pad(scores_, [[0, pad]])
+        classes_ = tf.pad(classes_, [[0, pad]])
+        return boxes_, scores_, classes_, num_detections
+
+    return tf.map_fn(_image_nms, (boxes, box_scores),
+                     dtype=(boxes.dtype, box_scores.dtype, tf.int32, tf.int32))
+
+
 def preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes):
     '''Preprocess true boxes to training input format
 
@@ -14,7 +14,7 @@ from collections import defaultdict
 from keras import backend as K
 from keras.models import Model
 from keras.layers import Input, Lambda
-from models.yolov3.yolov3_model import yolo_body, yolo_eval
+from models.yolov3.yolov3_model import yolo_body, yolo_eval, yolo_eval_batch
 from models.yolov3.image_utils import letterbox_image, image_to_ndarray, letterbox_image_tf_dynamic
 
 import pdb
@@ -68,6 +68,7 @@ class YOLOv3(object):
                                 self.input_image_shape,
                                 score_threshold=self.box_score_threshold,
                                 iou_threshold=self.nms_iou_threshold)
+        self._batch_outputs = None
 
     def create_model(self):
 
@@ -91,6 +92,66 @@ class YOLOv3(object):
             })
         return out_boxes, out_scores, out_classes
 
+    def _build_batch_graph(self):
+        ''' Graph of batch_predict, sharing the weights of self.model.
+
+        Images are fed zero padded to the largest image of the batch together
+        with their original shapes, each image is cropped back and letterboxed
+        on its own so it sees exactly the input of predict.
+        '''
+        self.batch_input_images = tf.placeholder(tf.float32, (None, None, None, 3))
+        self.batch_image_shapes = tf.placeholder(tf.int32, (None, 2))
+        size = self.model_image_size
+
+        def _letterbox(args):
+            image, image_shape = args
+            image = image[:image_shape[0], :image_shape[1]]
+            boxed_image = letterbox_image_tf_dynamic(image, size)[0]
+            boxed_image.set_shape((size[1], size[0], 3))
+            return boxed_image
+
+        boxed_images = tf.map_fn(_letterbox, (self.batch_input_images, self.batch_image_shapes),
+                                 dtype=tf.float32)
+        self._batch_outputs = yolo_eval_batch(self.model(boxed_images),
+                                self.anchors, self.num_classes,
+                                self.batch_image_shapes,
+                                score_threshold=self.box_score_threshold,
+                                iou_threshold=self.nms_iou_threshold)
+
+    def batch_predict(self, images):
+        '''
+        run a batch of PIL images of any sizes through one sess.run.
+
+        Output:
+            list of dictionary of list, one per image, same as predict.
+        '''
+        if self._batch_outputs is None:
+            self._build_batch_graph()
+        images_data = [image_to_ndarray(image, expand_dims=False) for image in images]
+        image_shapes = np.array([image_data.shape[:2] for image_data in images_data], dtype=np.int32)
+        batch_data = np.zeros((len(images_data),) + tuple(image_shapes.max(axis=0)) + (3,), dtype=np.float32)
+        for idx, image_data in enumerate(images_data):
+            batch_data[idx, :image_data.shape[0], :image_data.shape[1]] = image_data
+
+        out_boxes, out_scores, out_classes, out_nums = self.sess.run(
+            self._batch_outputs,
+            feed_dict={
+                self.batch_input_images: batch_data,
+                self.batch_image_shapes: image_shapes,
+                K.learning_phase(): 0
+            })
+
+        predictions = []
+        for boxes, scores, classes, num in zip(out_boxes, out_scores, out_classes, out_nums):
+            prediction = {}
+            prediction['boxes'] = boxes[:num].tolist()
+            prediction['scores'] = list(scores[:num])
+            prediction['classes'] = list(classes[:num])
+            prediction['class_names'] = [self.class_names[temp_class] for temp_class in classes[:num]]
+            prediction['namelist'] = self.class_names
+            predictions.append(prediction)
+        return predictions
+
     def predict(self, image, show_image=False):
         '''
         return dictionary of list
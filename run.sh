@@ -1,9 +1,4 @@
 #!/bin/bash
 
-GPU_IDS=(0 1 2 3)
-ATTACK_LAYER=(4 5 6 7)
-
-for ((i=0; i<4; i++))
-do
-    echo CUDA_VISIBLE_DEVICES=${GPU_IDS[$i]} python script_generate_adversarial_imagenet5000.py --dataset-dir ~/imagenet5000 --adv-method dr -tm resnet152 --res152-attacklayer ${ATTACK_LAYER[$i]} --step-size 2 --steps 500
-done
+# one job per (attack layer, shard) spread over the visible GPUs, rerun to resume.
+python script_launch_generation.py --gpus 0 1 2 3 --attack-layers 4 5 6 7 --num-shards 1 --dataset-dir ~/imagenet5000 --adv-method dr -tm resnet152 --step-size 2 --steps 500
\ No newline at end of file
@@ -11,6 +11,7 @@ import json
 
 from utils.image_utils import load_image, save_image
 from utils.torch_utils import numpy_to_variable, variable_to_numpy
+from utils.prediction_cache import PredictionCache, DEFAULT_CACHE_DIR, hash_torch_weights
 
 import pdb   
 
@@ -24,6 +25,7 @@ def parse_args(args):
     parser = argparse.ArgumentParser(description='Script for generating adversarial examples.')
     parser.add_argument('test_model', help='Model for testing AEs.', type=str)
     parser.add_argument('--dataset-dir', help='Dataset folder path.', default='/home/yantao/workspace/datasets/imagenet5000', type=str)
+    parser.add_argument('--cache-dir', help='Folder of the clean image prediction cache.', default=DEFAULT_CACHE_DIR, type=str)
 
     return parser.parse_args()
 
@@ -41,6 +43,7 @@ def main(args=None):
     if args.test_model == 'resnet50':
         test_model = torchvision.models.resnet50(pretrained=True).cuda()
         test_model.eval()
+    ori_cache = PredictionCache(args.test_model, hash_torch_weights(test_model), {'img_size' : (224, 224)}, cache_dir=args.cache_dir)
 
     test_folders = []
     for temp_folder in os.listdir(args.dataset_dir):
@@ -63,16 +66,19 @@ def main(args=None):
             image_ori_path = os.path.join(input_dir, image_name)
             image_adv_path = os.path.join(args.dataset_dir, curt_folder, image_name)
             image_adv_path = os.path.splitext(image_adv_path)[0] + '.png'
-                
-            image_ori_np = load_image(data_format='channels_first', abs_path=True, fpath=image_ori_path)
+
+            def _predict_ori():
+                image_ori_np = load_image(data_format='channels_first', abs_path=True, fpath=image_ori_path)
+                image_ori_var = numpy_to_variable(image_ori_np)
+                with torch.no_grad():
+                    logits_ori = test_model(image_ori_var)
+                return {'y_ori' : [int(logits_ori.argmax())]}
+            y_ori_var = ori_cache.get_or_compute(image_ori_path, _predict_ori)['y_ori'][0]
+
             image_adv_np = load_image(data_format='channels_first', abs_path=True, fpath=image_adv_path)
-            image_ori_var = numpy_to_variable(image_ori_np)
             image_adv_var = numpy_to_variable(image_adv_np)
-            
-            logits_ori = test_model(image_ori_var)
-            logits_adv = test_model(image_adv_var)
-
-            y_ori_var = logits_ori.argmax()
+            with torch.no_grad():
+                logits_adv = test_model(image_adv_var)
             y_adv_var = logits_adv.argmax()
 
             total_count += 1
@@ -2,24 +2,15 @@ import os
 import sys
 import shutil
 import json
-from keras import backend as K
 from PIL import Image
 import numpy as np
 from tqdm import tqdm
 import argparse
 import pickle
-from pycocotools.coco import COCO
-import cv2
 import datetime
 
-from models.yolov3.yolov3_wrapper import YOLOv3
-from models.retina_resnet50.keras_retina_resnet50 import KerasResNet50RetinaNetModel
-from models.retina_resnet50.retinanet_resnet_50.utils.image import read_image_bgr, preprocess_image, resize_image, resize_image_2
-from models.retina_resnet50.retinanet_resnet_50.utils.colors import label_color
-from models.retina_resnet50.retinanet_resnet_50.utils.visualization import draw_box, draw_caption
-from models.ssd_mobilenet.SSD import SSD_detector
 from utils.image_utils import load_image, save_image, save_bbox_img
-from utils.mAP import save_detection_to_file, calculate_mAP_from_files
+from utils.mAP import calculate_mAP
 from utils.VOC2012_1000.annotation_loader import load_annotations as load_voc_annotations
 from utils.COCO2017_1000.annotation_loader import load_annotations as load_coco_annotations
 
@@ -52,15 +43,22 @@ def main(args=None):
     if args.dataset_type == 'voc':
         gt_dir = os.path.join(args.dataset_dir, '_annotations')
     elif args.dataset_type == 'coco':
+        from pycocotools.coco import COCO
         gt_loader = COCO(os.path.join(args.dataset_dir, 'instances_val2017.json'))
 
+    # model backends are only imported when selected, each pulls in TensorFlow/Keras.
     if args.test_model == 'yolov3':
+        from keras import backend as K
+        from models.yolov3.yolov3_wrapper import YOLOv3
         test_model = YOLOv3(sess = K.get_session())
         img_size = (416, 416)
     elif args.test_model == 'retina_resnet50':
+        from models.retina_resnet50.keras_retina_resnet50 import KerasResNet50RetinaNetModel
+        from models.retina_resnet50.retinanet_resnet_50.utils.image import read_image_bgr, preprocess_image, resize_image, resize_image_2
         test_model = KerasResNet50RetinaNetModel()
         img_size = (416, 416)
     elif args.test_model == 'ssd_mobile':
+        from models.ssd_mobilenet.SSD import SSD_detector
         test_model = SSD_detector()
         img_size = (500, 500)
 
@@ -84,8 +82,8 @@ def main(args=None):
         if os.path.exists(result_dir):
             raise
         os.mkdir(result_dir)
-        os.mkdir(os.path.join(result_dir, 'gt'))
-        os.mkdir(os.path.join(result_dir, 'pd'))
+        gt_dic_dict = {}
+        pd_dic_dict = {}
 
         for adv_name in tqdm(os.listdir(os.path.join(args.dataset_dir, curt_folder))):
             temp_image_name_noext = os.path.splitext(adv_name)[0]
@@ -138,10 +136,7 @@ def main(args=None):
                 image = preprocess_image(image)
                 image = resize_image_2(image, img_size)
                 image, scale = resize_image(image)
-                pd_out = test_model.batch_predictions(np.expand_dims(image, axis=0))[0]
-                boxes_list = pd_out['boxes']
-                for idx, temp_box in enumerate(boxes_list):
-                    pd_out['boxes'][idx] = np.array(temp_box) / scale
+                pd_out = test_model.batch_predictions(np.expand_dims(image, axis=0), scales=[scale])[0]
             else:
                 image_adv_pil = Image.fromarray(image_adv_np.astype(np.uint8))
                 pd_out = test_model.predict(image_adv_pil)
@@ -152,8 +147,8 @@ def main(args=None):
                 if args.test_model == 'yolov3' or args.test_model == 'retina_resnet50':
                     pd_out = _transfer_label_to_coco91(pd_out, args)
 
-            save_detection_to_file(gt_out, os.path.join(result_dir, 'gt', temp_image_name_noext + '.txt'), 'ground_truth')
-            save_detection_to_file(pd_out, os.path.join(result_dir, 'pd', temp_image_name_noext + '.txt'), 'detection')
+            gt_dic_dict[temp_image_name_noext] = gt_out
+            pd_dic_dict[temp_image_name_noext] = pd_out
             
             if pd_out:
                 save_bbox_img(os.path.join(result_dir, 'temp_adv.jpg'), pd_out['boxes'], out_file='temp_adv_box.jpg')
@@ -161,7 +156,7 @@ def main(args=None):
                 save_bbox_img(os.path.join(result_dir, 'temp_adv.jpg'), [], out_file='temp_adv_box.jpg')
             
 
-        mAP_score = calculate_mAP_from_files(os.path.join(result_dir, 'gt'), os.path.join(result_dir, 'pd'))
+        mAP_score = calculate_mAP(gt_dic_dict, pd_dic_dict)
 
         shutil.rmtree(result_dir)
         print(curt_folder, ' : ', mAP_score)
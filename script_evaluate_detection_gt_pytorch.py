@@ -9,11 +9,10 @@ import argparse
 import torchvision
 import torch
 import pickle
-from pycocotools.coco import COCO
 import datetime
 
 from utils.image_utils import load_image, save_image, save_bbox_img
-from utils.mAP import save_detection_to_file, calculate_mAP_from_files
+from utils.mAP import calculate_mAP
 from utils.torch_utils import numpy_to_variable, variable_to_numpy, convert_torch_det_output
 from utils.VOC2012_1000.annotation_loader import load_annotations as load_voc_annotations
 from utils.COCO2017_1000.annotation_loader import load_annotations as load_coco_annotations
@@ -48,6 +47,7 @@ def main(args=None):
     if args.dataset_type == 'voc':
         gt_dir = os.path.join(args.dataset_dir, '_annotations')
     elif args.dataset_type == 'coco':
+        from pycocotools.coco import COCO
         gt_loader = COCO(os.path.join(args.dataset_dir, 'instances_val2017.json'))
 
     if args.test_model == 'fasterrcnn':
@@ -82,8 +82,8 @@ def main(args=None):
         if os.path.exists(result_dir):
             raise
         os.mkdir(result_dir)
-        os.mkdir(os.path.join(result_dir, 'gt'))
-        os.mkdir(os.path.join(result_dir, 'pd'))
+        gt_dic_dict = {}
+        pd_dic_dict = {}
         for adv_name in tqdm(os.listdir(os.path.join(args.dataset_dir, curt_folder))):
             temp_image_name_noext = os.path.splitext(adv_name)[0]
             if args.dataset_type == 'voc':
@@ -122,8 +122,8 @@ def main(args=None):
                 pd_out['boxes'][idx] = [temp_bbox[1], temp_bbox[0], temp_bbox[3], temp_bbox[2]]
 
 
-            save_detection_to_file(gt_out, os.path.join(result_dir, 'gt', temp_image_name_noext + '.txt'), 'ground_truth')
-            save_detection_to_file(pd_out, os.path.join(result_dir, 'pd', temp_image_name_noext + '.txt'), 'detection')
+            gt_dic_dict[temp_image_name_noext] = gt_out
+            pd_dic_dict[temp_image_name_noext] = pd_out
             
             if pd_out:
                 save_bbox_img(os.path.join(result_dir, 'temp_adv.png'), pd_out['boxes'], out_file=os.path.join(result_dir, 'temp_adv_box.png'))
@@ -131,7 +131,7 @@ def main(args=None):
                 save_bbox_img(os.path.join(result_dir, 'temp_adv.png'), [], out_file=os.path.join(result_dir, 'temp_adv_box.png'))
             
 
-        mAP_score = calculate_mAP_from_files(os.path.join(result_dir, 'gt'), os.path.join(result_dir, 'pd'))
+        mAP_score = calculate_mAP(gt_dic_dict, pd_dic_dict)
 
         shutil.rmtree(result_dir)
         print(curt_folder, ' : ', mAP_score)
@@ -2,21 +2,15 @@ import os
 import sys
 import shutil
 import json
-from keras import backend as K
 from PIL import Image
 import numpy as np
 from tqdm import tqdm
 import argparse
 import datetime
 
-from models.yolov3.yolov3_wrapper import YOLOv3
-from models.retina_resnet50.keras_retina_resnet50 import KerasResNet50RetinaNetModel
-from models.retina_resnet50.retinanet_resnet_50.utils.image import read_image_bgr, preprocess_image, resize_image, resize_image_2
-from models.retina_resnet50.retinanet_resnet_50.utils.colors import label_color
-from models.retina_resnet50.retinanet_resnet_50.utils.visualization import draw_box, draw_caption
-from models.ssd_mobilenet.SSD import SSD_detector
 from utils.image_utils import load_image, save_image, save_bbox_img
-from utils.mAP import save_detection_to_file, calculate_mAP_from_files
+from utils.mAP import calculate_mAP
+from utils.prediction_cache import PredictionCache, DEFAULT_CACHE_DIR, hash_file, hash_keras_weights
 
 
 PICK_LIST = []
@@ -28,6 +22,7 @@ def parse_args(args):
     parser = argparse.ArgumentParser(description='Script for generating adversarial examples.')
     parser.add_argument('test_model', help='Model for testing AEs.', type=str)
     parser.add_argument('--dataset-dir', help='Dataset folder path.', default='/home/yantao/workspace/datasets/imagenet5000', type=str)
+    parser.add_argument('--cache-dir', help='Folder of the clean image prediction cache.', default=DEFAULT_CACHE_DIR, type=str)
 
     return parser.parse_args()
 
@@ -42,16 +37,30 @@ def main(args=None):
 
     input_dir = os.path.join(args.dataset_dir, 'ori')
 
+    # model backends are only imported when selected, each pulls in TensorFlow/Keras.
     if args.test_model == 'yolov3':
+        from keras import backend as K
+        from models.yolov3.yolov3_wrapper import YOLOv3
         test_model = YOLOv3(sess = K.get_session())
         img_size = (416, 416)
     elif args.test_model == 'retina_resnet50':
+        from models.retina_resnet50.keras_retina_resnet50 import KerasResNet50RetinaNetModel
+        from models.retina_resnet50.retinanet_resnet_50.utils.image import read_image_bgr, preprocess_image, resize_image, resize_image_2
         test_model = KerasResNet50RetinaNetModel()
         img_size = (416, 416)
     elif args.test_model == 'ssd_mobile':
+        from models.ssd_mobilenet.SSD import SSD_detector
         test_model = SSD_detector()
         img_size = (500, 500)
 
+    if args.test_model == 'ssd_mobile':
+        weights_hash = hash_file(test_model.model_path)
+    elif args.test_model == 'yolov3':
+        weights_hash = hash_keras_weights(test_model.model)
+    else:
+        weights_hash = hash_keras_weights(test_model._model)
+    ori_cache = PredictionCache(args.test_model, weights_hash, {'img_size' : img_size}, cache_dir=args.cache_dir)
+
     test_folders = []
     for temp_folder in os.listdir(args.dataset_dir):
         if not os.path.isdir(os.path.join(args.dataset_dir, temp_folder)):
@@ -73,8 +82,8 @@ def main(args=None):
         if os.path.exists(result_dir):
             raise
         os.mkdir(result_dir)
-        os.mkdir(os.path.join(result_dir, 'gt'))
-        os.mkdir(os.path.join(result_dir, 'pd'))
+        gt_dic_dict = {}
+        pd_dic_dict = {}
 
         for image_name in tqdm(os.listdir(input_dir)):
             temp_image_name_noext = os.path.splitext(image_name)[0]
@@ -87,18 +96,19 @@ def main(args=None):
             
             image_ori_np = load_image(data_format='channels_last', shape=img_size, bounds=(0, 255), abs_path=True, fpath=ori_img_path)
             Image.fromarray((image_ori_np).astype(np.uint8)).save(os.path.join(result_dir, 'ori.jpg'))
-            if args.test_model == 'retina_resnet50':
-                image = read_image_bgr(ori_img_path)
-                image = preprocess_image(image)
-                image = resize_image_2(image, img_size)
-                image, scale = resize_image(image)
-                gt_out = test_model.batch_predictions(np.expand_dims(image, axis=0))[0]
-                boxes_list = gt_out['boxes']
-                for idx, temp_box in enumerate(boxes_list):
-                    gt_out['boxes'][idx] = np.array(temp_box) / scale
-            else:
-                image_ori_pil = Image.fromarray(image_ori_np.astype(np.uint8))
-                gt_out = test_model.predict(image_ori_pil)
+            def _predict_ori():
+                if args.test_model == 'retina_resnet50':
+                    image = read_image_bgr(ori_img_path)
+                    image = preprocess_image(image)
+                    image = resize_image_2(image, img_size)
+                    image, scale = resize_image(image)
+                    gt_out = test_model.batch_predictions(np.expand_dims(image, axis=0), scales=[scale])[0]
+                else:
+                    image_ori_pil = Image.fromarray(image_ori_np.astype(np.uint8))
+                    gt_out = test_model.predict(image_ori_pil)
+                return gt_out
+            # the clean prediction is shared by all folders and runs.
+            gt_out = ori_cache.get_or_compute(ori_img_path, _predict_ori)
             
             image_adv_np = load_image(data_format='channels_last', shape=img_size, bounds=(0, 255), abs_path=True, fpath=adv_img_path)
             Image.fromarray((image_adv_np).astype(np.uint8)).save(os.path.join(result_dir, 'temp_adv.jpg'))
@@ -107,16 +117,13 @@ def main(args=None):
                 image = preprocess_image(image)
                 image = resize_image_2(image, img_size)
                 image, scale = resize_image(image)
-                pd_out = test_model.batch_predictions(np.expand_dims(image, axis=0))[0]
-                boxes_list = pd_out['boxes']
-                for idx, temp_box in enumerate(boxes_list):
-                    pd_out['boxes'][idx] = np.array(temp_box) / scale
+                pd_out = test_model.batch_predictions(np.expand_dims(image, axis=0), scales=[scale])[0]
             else:
                 image_adv_pil = Image.fromarray(image_adv_np.astype(np.uint8))
                 pd_out = test_model.predict(image_adv_pil)
 
-            save_detection_to_file(gt_out, os.path.join(result_dir, 'gt', temp_image_name_noext + '.txt'), 'ground_truth')
-            save_detection_to_file(pd_out, os.path.join(result_dir, 'pd', temp_image_name_noext + '.txt'), 'detection')
+            gt_dic_dict[temp_image_name_noext] = gt_out
+            pd_dic_dict[temp_image_name_noext] = pd_out
             
             
             if gt_out:
@@ -129,7 +136,7 @@ def main(args=None):
                 save_bbox_img(os.path.join(result_dir, 'temp_adv.jpg'), [], out_file='temp_adv_box.jpg')
             
 
-        mAP_score = calculate_mAP_from_files(os.path.join(result_dir, 'gt'), os.path.join(result_dir, 'pd'))
+        mAP_score = calculate_mAP(gt_dic_dict, pd_dic_dict)
         shutil.rmtree(result_dir)
         print(curt_folder, ' : ', mAP_score)
         result_dict[curt_folder] = 'mAP: {0:.04f}'.format(mAP_score)
@@ -11,7 +11,7 @@ import torch
 import datetime
 
 from utils.image_utils import load_image, save_image, save_bbox_img
-from utils.mAP import save_detection_to_file, calculate_mAP_from_files
+from utils.mAP import calculate_mAP
 from utils.torch_utils import numpy_to_variable, variable_to_numpy, convert_torch_det_output
 
 
@@ -71,8 +71,8 @@ def main(args=None):
         if os.path.exists(result_dir):
             raise
         os.mkdir(result_dir)
-        os.mkdir(os.path.join(result_dir, 'gt'))
-        os.mkdir(os.path.join(result_dir, 'pd'))
+        gt_dic_dict = {}
+        pd_dic_dict = {}
         is_missing = False
         for image_name in tqdm(os.listdir(input_dir)):
             temp_image_name_noext = os.path.splitext(image_name)[0]
@@ -99,8 +99,8 @@ def main(args=None):
                 pd_out = test_model(image_adv_var)
             pd_out = convert_torch_det_output(pd_out, cs_th=0.3)[0]
 
-            save_detection_to_file(gt_out, os.path.join(result_dir, 'gt', temp_image_name_noext + '.txt'), 'ground_truth')
-            save_detection_to_file(pd_out, os.path.join(result_dir, 'pd', temp_image_name_noext + '.txt'), 'detection')
+            gt_dic_dict[temp_image_name_noext] = gt_out
+            pd_dic_dict[temp_image_name_noext] = pd_out
             
             if gt_out:
                 save_bbox_img(os.path.join(result_dir, 'temp_ori.png'), gt_out['boxes'], out_file=os.path.join(result_dir, 'temp_ori_box.png'))
@@ -112,7 +112,7 @@ def main(args=None):
                 save_bbox_img(os.path.join(result_dir, 'temp_adv.png'), [], out_file=os.path.join(result_dir, 'temp_adv_box.png'))
             
 
-        mAP_score = calculate_mAP_from_files(os.path.join(result_dir, 'gt'), os.path.join(result_dir, 'pd'))
+        mAP_score = calculate_mAP(gt_dic_dict, pd_dic_dict)
         shutil.rmtree(result_dir)
         print(curt_folder, ' : ', mAP_score)
         result_dict[curt_folder] = 'mAP: {0:.04f}'.format(mAP_score)
@@ -2,25 +2,16 @@ import os
 import sys
 import shutil
 import json
-from keras import backend as K
 from PIL import Image
 import numpy as np
 from tqdm import tqdm
 import argparse
 import pickle
-from pycocotools.coco import COCO
-import cv2
 import datetime
 import pickle
 
-from models.yolov3.yolov3_wrapper import YOLOv3
-from models.retina_resnet50.keras_retina_resnet50 import KerasResNet50RetinaNetModel
-from models.retina_resnet50.retinanet_resnet_50.utils.image import read_image_bgr, preprocess_image, resize_image, resize_image_2
-from models.retina_resnet50.retinanet_resnet_50.utils.colors import label_color
-from models.retina_resnet50.retinanet_resnet_50.utils.visualization import draw_box, draw_caption
-from models.ssd_mobilenet.SSD import SSD_detector
 from utils.image_utils import load_image, save_image, save_bbox_img
-from utils.mAP import save_detection_to_file, calculate_mAP_from_files
+from utils.mAP import calculate_mAP
 from utils.VOC2012_1000.annotation_loader import load_annotations as load_voc_annotations
 from utils.COCO2017_1000.annotation_loader import load_annotations as load_coco_annotations
 
@@ -57,6 +48,7 @@ def main(args=None):
     if args.dataset_type == 'voc':
         gt_dir = os.path.join(args.dataset_dir, '_annotations')
     elif args.dataset_type == 'coco':
+        from pycocotools.coco import COCO
         gt_loader = COCO(os.path.join(args.dataset_dir, 'instances_val2017.json'))
 
     test_folders = []
@@ -79,8 +71,8 @@ def main(args=None):
         if os.path.exists(result_dir):
             raise
         os.mkdir(result_dir)
-        os.mkdir(os.path.join(result_dir, 'gt'))
-        os.mkdir(os.path.join(result_dir, 'pd'))
+        gt_dic_dict = {}
+        pd_dic_dict = {}
 
         for adv_name in tqdm(os.listdir(os.path.join(args.dataset_dir, curt_folder))):
             temp_image_name_noext = os.path.splitext(adv_name)[0]
@@ -116,11 +108,11 @@ def main(args=None):
                 pd_out['boxes'].append([temp_box[0] * img_size[0], temp_box[1] * img_size[1], temp_box[2] * img_size[0], temp_box[3] * img_size[1]])
             if args.dataset_type == 'voc':
                 pd_out = _transfer_label_to_voc(pd_out, args)
-            save_detection_to_file(gt_out, os.path.join(result_dir, 'gt', temp_image_name_noext + '.txt'), 'ground_truth')
-            save_detection_to_file(pd_out, os.path.join(result_dir, 'pd', temp_image_name_noext + '.txt'), 'detection')
+            gt_dic_dict[temp_image_name_noext] = gt_out
+            pd_dic_dict[temp_image_name_noext] = pd_out
             
 
-        mAP_score = calculate_mAP_from_files(os.path.join(result_dir, 'gt'), os.path.join(result_dir, 'pd'))
+        mAP_score = calculate_mAP(gt_dic_dict, pd_dic_dict)
 
         shutil.rmtree(result_dir)
         print(curt_folder, ' : ', mAP_score)
@@ -9,11 +9,9 @@ import json
 import torchvision
 import torch
 import pickle
-from pycocotools.coco import COCO
 import cv2
 
 from models.deeplabv3plus.utils.metrics import Evaluator
-from models.deeplabv3plus.modeling.deeplab import *
 from utils.image_utils import load_image, save_image
 from utils.torch_utils import numpy_to_variable, variable_to_numpy
 from utils.COCO2017_1000.mask_loader import load_masks as load_coco_masks
@@ -53,10 +51,12 @@ def test(args):
         gt_dir = os.path.join(args.dataset_dir, '_segmentations')
         
     elif args.dataset_type == 'coco':
+        from pycocotools.coco import COCO
         gt_loader = COCO(os.path.join(args.dataset_dir, 'instances_val2017.json'))
         to_voc_21 = _convert_label(VOC_AND_COCO91_CLASSES)
 
     if args.test_model == 'deeplabv3plus':
+        from models.deeplabv3plus.modeling.deeplab import DeepLab
         args_dic['num_classes'] = 21
         model = DeepLab(
             num_classes=21,
@@ -173,10 +173,8 @@ def test(args):
                         output_adv = model(image_adv_var)['out']
             
             pred_ori = np.expand_dims(output_ori, axis=0)
-            pred_adv = output_adv.data.cpu().numpy()
-            pred_adv = np.argmax(pred_adv, axis=1)
-
-            evaluator.add_batch(pred_ori, pred_adv)
+            # argmax and confusion matrix update stay on the GPU.
+            evaluator.add_batch(pred_ori, output_adv)
 
         try:
             Acc = evaluator.Pixel_Accuracy()
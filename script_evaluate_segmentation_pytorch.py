@@ -10,9 +10,9 @@ import torchvision
 import torch
 
 from models.deeplabv3plus.utils.metrics import Evaluator
-from models.deeplabv3plus.modeling.deeplab import *
 from utils.image_utils import load_image, save_image
 from utils.torch_utils import numpy_to_variable, variable_to_numpy
+from utils.prediction_cache import PredictionCache, DEFAULT_CACHE_DIR, hash_file, hash_torch_weights
 
 
 PICK_LIST = []
@@ -27,14 +27,44 @@ def parse_args(args):
                         help='deeplabv3plus backbone name (default: resnet)')
     parser.add_argument('--dataset-dir', help='Dataset folder path.', 
                         default='/home/yantao/workspace/datasets/imagenet5000', type=str)
+    parser.add_argument('--cache-dir', help='Folder of the clean image prediction cache.', 
+                        default=DEFAULT_CACHE_DIR, type=str)
+    parser.add_argument('--batch-folders', help='Run the variants of an image in all folders as one batch.', 
+                        action='store_true')
+    parser.add_argument('--max-batch-size', help='Max images per forward pass with --batch-folders.', 
+                        default=8, type=int)
     return parser.parse_args(args)
 
+def _result_str(evaluator):
+    try:
+        Acc = evaluator.Pixel_Accuracy()
+        Acc_class = evaluator.Pixel_Accuracy_Class()
+        mIoU = evaluator.Mean_Intersection_over_Union()
+        FWIoU = evaluator.Frequency_Weighted_Intersection_over_Union()
+    except:
+        Acc = 0.
+        Acc_class = 0.
+        mIoU = 0.
+        FWIoU = 0.
+    return 'Acc : {0:.04f}, Acc_class : {1:.04f}, mIoU : {2:.04f}, FWIoU : {3:.04f}'.format(Acc, Acc_class, mIoU, FWIoU)
+
+def _folder_chunks(img_paths, adv_folders, max_batch_size, with_ori):
+    '''
+    yield (chunk of img_paths, folders of the adversarial images in it).
+    with_ori means img_paths starts with the clean image, which has no folder.
+    '''
+    offset = 1 if with_ori else 0
+    for start in range(0, len(img_paths), max_batch_size):
+        end = start + max_batch_size
+        yield img_paths[start : end], adv_folders[max(start - offset, 0) : end - offset]
+
 def test(args):
     args_dic = vars(args)
 
     input_dir = os.path.join(args.dataset_dir, 'ori')
 
     if args.test_model == 'deeplabv3plus':
+        from models.deeplabv3plus.modeling.deeplab import DeepLab
         args_dic['num_classes'] = 21
         model = DeepLab(
             num_classes=21,
@@ -89,6 +119,19 @@ def test(args):
     else:
         raise ValueError(' ')
 
+    if args.test_model == 'deeplabv3plus':
+        model_name = 'deeplabv3plus_' + args.dlv3p_backbone
+        weights_hash = hash_file(args.pretrained_path)
+    else:
+        model_name = args.test_model
+        weights_hash = hash_torch_weights(model)
+    ori_cache = PredictionCache(
+        model_name, 
+        weights_hash, 
+        {'img_size' : img_size, 'img_mean' : img_mean, 'img_std' : img_std, 'img_transforms' : img_transforms is not None}, 
+        cache_dir=args.cache_dir
+    )
+
     evaluator = Evaluator(args.num_classes)
 
     test_folders = []
@@ -104,34 +147,98 @@ def test(args):
         test_folders.append(temp_folder)
     
     result_dict = {}
-    for curt_folder in tqdm(test_folders):
-        print('Folder : {0}'.format(curt_folder))
-        evaluator.reset()
-        for image_name in tqdm(os.listdir(input_dir)):
-            temp_image_name_noext = os.path.splitext(image_name)[0]
-            ori_img_path = os.path.join(input_dir, image_name)
-            adv_img_path = os.path.join(args.dataset_dir, curt_folder, image_name)
-            adv_img_path = os.path.splitext(adv_img_path)[0] + '.png'
+    if args.batch_folders:
+        def _load_input(img_path):
             if img_transforms == None:
-                image_ori_np = load_image(
+                image_np = load_image(
                     data_format='channels_first', 
                     shape=img_size, 
                     bounds=(0, 1), 
                     abs_path=True, 
-                    fpath=ori_img_path
+                    fpath=img_path
                 )
-                #Image.fromarray(np.transpose(image_ori_np * 255., (1, 2, 0)).astype(np.uint8)).save('ori.jpg')
-                image_ori_var = numpy_to_variable(image_ori_np)
-                with torch.no_grad():
-                    if args.test_model == 'deeplabv3plus':
-                        output_ori = model(image_ori_var)
-            else:
-                image_ori_var = img_transforms(Image.open(ori_img_path).convert('RGB')).unsqueeze_(axis=0).cuda()
+                return numpy_to_variable(image_np)
+            return img_transforms(Image.open(img_path).convert('RGB')).unsqueeze_(axis=0).cuda()
+
+        # one Evaluator per folder, each clean image is read once and all of its
+        # variants go through the model together.
+        evaluators = {curt_folder : Evaluator(args.num_classes) for curt_folder in test_folders}
+        for image_name in tqdm(os.listdir(input_dir)):
+            ori_img_path = os.path.join(input_dir, image_name)
+            adv_folders = []
+            img_paths = []
+            for curt_folder in test_folders:
+                adv_img_path = os.path.splitext(os.path.join(args.dataset_dir, curt_folder, image_name))[0] + '.png'
+                if not os.path.exists(adv_img_path):
+                    print('File {0} not found in {1}.'.format(image_name, curt_folder))
+                    continue
+                adv_folders.append(curt_folder)
+                img_paths.append(adv_img_path)
+            if len(img_paths) == 0:
+                continue
+            pred_ori = ori_cache.get(ori_img_path)
+            if pred_ori is None:
+                img_paths = [ori_img_path] + img_paths
+            for chunk_paths, chunk_folders in _folder_chunks(img_paths, adv_folders, args.max_batch_size, pred_ori is None):
+                image_var = torch.cat([_load_input(img_path) for img_path in chunk_paths])
                 with torch.no_grad():
                     if args.test_model == 'deeplabv3plus':
-                        output_ori = model(image_ori_var)
+                        outputs = model(image_var)
                     else:
-                        output_ori = model(image_ori_var)['out']
+                        outputs = model(image_var)['out']
+                if pred_ori is None:
+                    pred_ori = {'pred_ori' : outputs[:1].argmax(dim=1).cpu().numpy().astype(np.uint8)}
+                    ori_cache.put(ori_img_path, pred_ori)
+                    outputs = outputs[1:]
+                pred_ori_np = np.asarray(pred_ori['pred_ori']).astype(np.int64)
+                assert len(chunk_folders) == len(outputs)
+                for curt_folder, output_adv in zip(chunk_folders, outputs):
+                    evaluators[curt_folder].add_batch(pred_ori_np, output_adv.unsqueeze(0))
+
+        for curt_folder in test_folders:
+            result_str = _result_str(evaluators[curt_folder])
+            print(curt_folder, ' : ', result_str)
+            result_dict[curt_folder] = result_str
+        with open('temp_seg_results_{0}.json'.format(args.test_model), 'w') as fout:
+            json.dump(result_dict, fout, indent=2)
+        return
+
+    for curt_folder in tqdm(test_folders):
+        print('Folder : {0}'.format(curt_folder))
+        evaluator.reset()
+        for image_name in tqdm(os.listdir(input_dir)):
+            temp_image_name_noext = os.path.splitext(image_name)[0]
+            ori_img_path = os.path.join(input_dir, image_name)
+            adv_img_path = os.path.join(args.dataset_dir, curt_folder, image_name)
+            adv_img_path = os.path.splitext(adv_img_path)[0] + '.png'
+            if not os.path.exists(adv_img_path):
+                print('File {0} not found.'.format(image_name))
+                continue
+            def _predict_ori():
+                if img_transforms == None:
+                    image_ori_np = load_image(
+                        data_format='channels_first', 
+                        shape=img_size, 
+                        bounds=(0, 1), 
+                        abs_path=True, 
+                        fpath=ori_img_path
+                    )
+                    #Image.fromarray(np.transpose(image_ori_np * 255., (1, 2, 0)).astype(np.uint8)).save('ori.jpg')
+                    image_ori_var = numpy_to_variable(image_ori_np)
+                    with torch.no_grad():
+                        if args.test_model == 'deeplabv3plus':
+                            output_ori = model(image_ori_var)
+                else:
+                    image_ori_var = img_transforms(Image.open(ori_img_path).convert('RGB')).unsqueeze_(axis=0).cuda()
+                    with torch.no_grad():
+                        if args.test_model == 'deeplabv3plus':
+                            output_ori = model(image_ori_var)
+                        else:
+                            output_ori = model(image_ori_var)['out']
+                pred_ori = output_ori.argmax(dim=1).cpu().numpy()
+                return {'pred_ori' : pred_ori.astype(np.uint8)}
+            # the clean prediction is shared by all folders and runs.
+            pred_ori = np.asarray(ori_cache.get_or_compute(ori_img_path, _predict_ori)['pred_ori']).astype(np.int64)
             
             #Image.fromarray((output_ori[0].argmax(axis=0).cpu().numpy().astype(np.float32) / 21. * 255.).astype(np.uint8)).save('ori_fm.jpg')
             
@@ -158,25 +265,10 @@ def test(args):
             
             #Image.fromarray((output_adv[0].argmax(axis=0).cpu().numpy().astype(np.float32) / 21. * 255.).astype(np.uint8)).save('adv_fm.jpg')
 
-            pred_ori = output_ori.data.cpu().numpy()
-            pred_ori = np.argmax(pred_ori, axis=1)
-            pred_adv = output_adv.data.cpu().numpy()
-            pred_adv = np.argmax(pred_adv, axis=1)
-
-            evaluator.add_batch(pred_ori, pred_adv)
-
-        try:
-            Acc = evaluator.Pixel_Accuracy()
-            Acc_class = evaluator.Pixel_Accuracy_Class()
-            mIoU = evaluator.Mean_Intersection_over_Union()
-            FWIoU = evaluator.Frequency_Weighted_Intersection_over_Union()
-        except:
-            Acc = 0.
-            Acc_class = 0.
-            mIoU = 0.
-            FWIoU = 0.
-
-        result_str = 'Acc : {0:.04f}, Acc_class : {1:.04f}, mIoU : {2:.04f}, FWIoU : {3:.04f}'.format(Acc, Acc_class, mIoU, FWIoU)
+            # argmax and confusion matrix update stay on the GPU.
+            evaluator.add_batch(pred_ori, output_adv)
+
+        result_str = _result_str(evaluator)
         print(curt_folder, ' : ', result_str)
         result_dict[curt_folder] = result_str
 
@@ -16,7 +16,8 @@ from attacks.linf_pgd import LinfPGDAttack
 from models.vgg import Vgg16
 from models.resnet import Resnet152
 from models.inception import Inception_v3
-from utils.image_utils import load_image, save_image
+from utils.image_utils import load_image, save_image, AsyncImageWriter
+from utils.dataset_utils import PrefetchImageLoader
 from utils.torch_utils import numpy_to_variable, variable_to_numpy
 
 DEBUG = False
@@ -36,6 +37,17 @@ def parse_args(args):
     parser.add_argument('--vgg16-attacklayer', help='VGG16 attack layer idx.', default=14, type=int)
     parser.add_argument('--inc3-attacklayer', help='Inception v3 attack layer idx.', default=-1, type=int)
     parser.add_argument('--res152-attacklayer', help='Resnet152 attack layer idx.', default=-1, type=int)
+    parser.add_argument('--num-workers', help='Number of image loading workers.', default=4, type=int)
+    parser.add_argument('--output-codec', help='Output format, npy (raw uint8) outputs are not read by the evaluation scripts.', default='png', choices=['png', 'npy'], type=str)
+    parser.add_argument('--png-compress-level', help='PNG compression level, 0 - 9.', default=6, type=int)
+    parser.add_argument('--num-writers', help='Number of image saving workers.', default=2, type=int)
+    parser.add_argument('--num-shards', help='Split the image list into this many shards.', default=1, type=int)
+    parser.add_argument('--shard-index', help='Index of the shard processed by this run.', default=0, type=int)
+    parser.add_argument('--resume', help='Skip images whose output already exists and is valid, required when the output folder exists.', action='store_true')
+    parser.add_argument('--seed', help='Base random seed for baseline attacks, image i of the listing uses seed + i.', default=None, type=int)
+    parser.add_argument('--device', help='Torch device running the attack, e.g. cuda or cpu.', default='cuda', type=str)
+    parser.add_argument('--precision', help='Model precision, fp32 or bf16 (autocast).', default='fp32', choices=['fp32', 'bf16'], type=str)
+    parser.add_argument('--channels-last', help='Run the model with channels_last memory format.', action='store_true')
 
     return parser.parse_args()
 
@@ -54,23 +66,29 @@ def main(args=None):
     internal = None
     attack = None
     attack_layer_idx = None
+    device = torch.device(args.device)
+    precision_kwargs = {
+        'device' : device,
+        'precision' : args.precision,
+        'channels_last' : args.channels_last,
+    }
     if args.adv_method == 'dr':
         loss_mtd = args.loss_method
         if args.target_model == 'vgg16':
             assert args.vgg16_attacklayer != -1
-            target_model = Vgg16()
+            target_model = Vgg16(device=device)
             internal = [i for i in range(29)]
             attack_layer_idx = [args.vgg16_attacklayer] # 12, 14
             args_dic['image_size'] = (224, 224)
         elif args.target_model == 'resnet152':
             assert args.res152_attacklayer != -1
-            target_model = Resnet152()
+            target_model = Resnet152(device=device)
             internal = [i for i in range(9)]
             attack_layer_idx = [args.res152_attacklayer] # #[4, 5, 6, 7]
             args_dic['image_size'] = (224, 224)
         elif args.target_model == 'inception_v3':
             assert args.inc3_attacklayer != -1
-            target_model = Inception_v3()
+            target_model = Inception_v3(device=device)
             internal = [i for i in range(14)]
             attack_layer_idx =  [args.inc3_attacklayer] # [3, 4, 7, 8, 12]
             args_dic['image_size'] = (299, 299)
@@ -82,7 +100,9 @@ def main(args=None):
             epsilon=args.epsilon/255., 
             step_size=args.step_size/255., 
             steps=args.steps, 
-            loss_mtd=loss_mtd
+            loss_mtd=loss_mtd,
+            attack_layer_idx_list=attack_layer_idx,
+            **precision_kwargs
         )
 
     elif args.adv_method == 'tidim' or args.adv_method == 'dim' or args.adv_method == 'mifgsm' or args.adv_method == 'pgd':
@@ -91,13 +111,13 @@ def main(args=None):
         loss_mtd = ''
 
         if args.target_model == 'vgg16':
-            target_model = torchvision.models.vgg16(pretrained=True).cuda().eval()
+            target_model = torchvision.models.vgg16(pretrained=True).to(device).eval()
             args_dic['image_size'] = (224, 224)
         elif args.target_model == 'resnet152':
-            target_model = torchvision.models.resnet152(pretrained=True).cuda().eval()
+            target_model = torchvision.models.resnet152(pretrained=True).to(device).eval()
             args_dic['image_size'] = (224, 224)
         elif args.target_model == 'inception_v3':
-            target_model = torchvision.models.inception_v3(pretrained=True).cuda().eval()
+            target_model = torchvision.models.inception_v3(pretrained=True).to(device).eval()
             args_dic['image_size'] = (299, 299)
         else:
             raise ValueError('Invalid adv_method.')
@@ -110,7 +130,8 @@ def main(args=None):
                 epsilon=args.epsilon/255., 
                 step_size=args.step_size/255., 
                 steps=args.steps, 
-                image_resize=330
+                image_resize=330,
+                **precision_kwargs
             )
         elif args.adv_method == 'mifgsm':
             attack = MomentumIteratorAttack(
@@ -119,7 +140,8 @@ def main(args=None):
                 epsilon=args.epsilon/255., 
                 step_size=args.step_size/255., 
                 steps=args.steps, 
-                random_start=False
+                random_start=False,
+                **precision_kwargs
             )
         elif args.adv_method == 'pgd':
             attack = LinfPGDAttack(
@@ -127,7 +149,8 @@ def main(args=None):
                 epsilon=args.epsilon/255., 
                 a=args.step_size/255., 
                 k=args.steps,  
-                random_start=False
+                random_start=False,
+                **precision_kwargs
             )
         elif args.adv_method == 'tidim':
             attack = TIDIM_Attack(
@@ -137,7 +160,8 @@ def main(args=None):
                 epsilon=args.epsilon/255., 
                 step_size=args.step_size/255., 
                 steps=args.steps, 
-                image_resize=330
+                image_resize=330,
+                **precision_kwargs
             )
         
     else:
@@ -162,30 +186,44 @@ def main(args=None):
             )
         )
         
-        if os.path.exists(args.output_dir):
-            raise ValueError('Output folder existed.')
-        os.mkdir(args.output_dir)
+        # shards of one run share the output folder, they are started with
+        # --resume so that stale results of another run are never mixed in.
+        if os.path.exists(args.output_dir) and not args.resume:
+            raise ValueError('Output folder existed, pass --resume to continue it.')
+        os.makedirs(args.output_dir, exist_ok=True)
         
 
-    count = 0
-    images_list = []
-    names_list = []
-    total_images = len(os.listdir(args.input_dir))
     assert args.batch_size > 0
-    for image_count, image_name in enumerate(tqdm(os.listdir(args.input_dir))):
-        image_path = os.path.join(args.input_dir, image_name)
-        image_np = load_image(shape=args.image_size, data_format='channels_first', abs_path=True, fpath=image_path)
-        images_list.append(image_np)
-        names_list.append(image_name)
-        count += 1
-        if count < args.batch_size and image_count != total_images - 1:
-            continue
-
-        images_np = np.array(images_list)
-        count = 0
-        images_list = []
-
-        images_var = numpy_to_variable(images_np)
+    assert 0 <= args.shard_index < args.num_shards
+    image_names = sorted(os.listdir(args.input_dir))
+    image_idx_dic = {image_name : idx for idx, image_name in enumerate(image_names)}
+    image_names = image_names[args.shard_index::args.num_shards]
+
+    writer = None
+    if not DEBUG:
+        writer = AsyncImageWriter(
+            args.output_dir, 
+            codec=args.output_codec, 
+            png_compress_level=args.png_compress_level, 
+            num_workers=args.num_writers
+        )
+        if args.resume:
+            writer.remove_temp_outputs(image_names)
+            image_names = [image_name for image_name in image_names if not writer.has_valid_output(image_name)]
+
+    loader = PrefetchImageLoader(
+        args.input_dir, 
+        args.batch_size, 
+        shape=args.image_size, 
+        data_format='channels_first', 
+        image_names=image_names, 
+        num_workers=args.num_workers, 
+        pin_memory=device.type == 'cuda'
+    )
+    for images_np, names_list in tqdm(loader):
+        seeds_list = [args.seed + image_idx_dic[image_name] for image_name in names_list] if args.seed is not None else None
+
+        images_var = torch.from_numpy(images_np).to(device, non_blocking=True)
         if args.adv_method == 'dr':
             advs = attack(
                 images_var,
@@ -193,21 +231,21 @@ def main(args=None):
                 internal
             )
         else:
-            assert args.batch_size == 1, 'Baselines are not tested for batch input.'
             target_model.eval()
-            logits_nat = target_model(images_var)
-            y_var = logits_nat.argmax().long().unsqueeze(0)
+            with torch.no_grad():
+                logits_nat = target_model(images_var)
+            y_var = logits_nat.argmax(1).long()
             advs = attack(
                 images_var.cpu(), 
-                y_var.cpu()
+                y_var.cpu(),
+                seeds=seeds_list
             )
 
         if not DEBUG:
-            advs_np = variable_to_numpy(advs)
-            for idx, adv_np in enumerate(advs_np):
-                image_pil = Image.fromarray(np.transpose((adv_np * 255).astype(np.uint8), (1, 2, 0)))
-                image_pil.save(os.path.join(args.output_dir, os.path.splitext(names_list[idx])[0] + '.png'))
-        names_list = []
+            writer.write(variable_to_numpy(advs), names_list)
+
+    if writer is not None:
+        writer.close()
 
 
 if __name__ == '__main__':
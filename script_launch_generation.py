@@ -0,0 +1,85 @@
+import os
+import sys
+import subprocess
+import threading
+import argparse
+import itertools
+from queue import Queue, Empty
+
+import pdb
+
+ATTACK_LAYER_ARGS = {
+    'vgg16' : '--vgg16-attacklayer',
+    'resnet152' : '--res152-attacklayer',
+    'inception_v3' : '--inc3-attacklayer',
+}
+
+def parse_args(args):
+    """ Parse the arguments.
+        Arguments not listed here are passed on to script_generate_adversarial.py.
+    """
+    parser = argparse.ArgumentParser(description='Script for spreading adversarial generation jobs over GPUs.')
+    parser.add_argument('-tm', '--target-model',  help='Target model for generating AEs.', default='vgg16', type=str)
+    parser.add_argument('--attack-layers', help='Attack layer idx, one job group per layer.', nargs='+', default=[None], type=int)
+    parser.add_argument('--num-shards', help='Number of shards per attack layer.', default=1, type=int)
+    parser.add_argument('--gpus', help='GPU ids to use, defaults to all visible devices.', nargs='+', default=None, type=str)
+    parser.add_argument('--jobs-per-gpu', help='Number of jobs running on a GPU at a time.', default=1, type=int)
+    parser.add_argument('--log-dir', help='Folder for per job logs.', default='./logs', type=str)
+    return parser.parse_known_args(args)
+
+def _visible_gpus():
+    if os.environ.get('CUDA_VISIBLE_DEVICES'):
+        return os.environ['CUDA_VISIBLE_DEVICES'].split(',')
+    import torch
+    return [str(idx) for idx in range(torch.cuda.device_count())]
+
+def _run_jobs(gpu_id, job_queue, log_dir, failed_jobs):
+    while True:
+        try:
+            job_name, job_args = job_queue.get_nowait()
+        except Empty:
+            return
+        env = dict(os.environ, CUDA_VISIBLE_DEVICES=gpu_id)
+        print('GPU {0} : {1}'.format(gpu_id, job_name))
+        with open(os.path.join(log_dir, job_name + '.log'), 'w') as log_file:
+            ret = subprocess.call(job_args, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        if ret != 0:
+            failed_jobs.append(job_name)
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args, generation_args = parse_args(args)
+
+    gpus = args.gpus if args.gpus is not None else _visible_gpus()
+    assert len(gpus) > 0, 'No GPU available.'
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script_generate_adversarial.py')
+    job_queue = Queue()
+    for attack_layer, shard_index in itertools.product(args.attack_layers, range(args.num_shards)):
+        job_args = [sys.executable, script_path, '-tm', args.target_model, '--resume',
+                    '--num-shards', str(args.num_shards), '--shard-index', str(shard_index)] + generation_args
+        job_name = '{0}_shard_{1}_of_{2}'.format(args.target_model, shard_index, args.num_shards)
+        if attack_layer is not None:
+            job_args += [ATTACK_LAYER_ARGS[args.target_model], str(attack_layer)]
+            job_name = '{0}_layerAt_{1}_shard_{2}_of_{3}'.format(args.target_model, attack_layer, shard_index, args.num_shards)
+        job_queue.put((job_name, job_args))
+
+    failed_jobs = []
+    workers = []
+    for gpu_id in gpus:
+        for _ in range(args.jobs_per_gpu):
+            worker = threading.Thread(target=_run_jobs, args=(gpu_id, job_queue, args.log_dir, failed_jobs))
+            worker.start()
+            workers.append(worker)
+    for worker in workers:
+        worker.join()
+
+    if len(failed_jobs) > 0:
+        print('Failed jobs, rerun the same command to resume them : ', failed_jobs)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import os
+import time
+import argparse
+import numpy as np
+import torch
+import torchvision
+
+from attacks.dispersion import DispersionAttack_gpu
+from attacks.DIM import DIM_Attack
+from attacks.ti_dim import TIDIM_Attack
+from attacks.mifgsm import MomentumIteratorAttack
+from attacks.linf_pgd import LinfPGDAttack
+from models.vgg import Vgg16
+from models.resnet import Resnet152
+from models.inception import Inception_v3
+from utils.image_utils import load_image
+
+import pdb
+
+
+# (precision, channels_last) of every mode, fp32 is the reference.
+MODES = {
+    'fp32' : ('fp32', False),
+    'fp32_cl' : ('fp32', True),
+    'bf16' : ('bf16', False),
+    'bf16_cl' : ('bf16', True),
+}
+
+# wrapper, number of internal layers, default DR attack layer, image size.
+TARGET_MODELS = {
+    'vgg16' : (Vgg16, 29, 14, (224, 224)),
+    'resnet152' : (Resnet152, 9, 5, (224, 224)),
+    'inception_v3' : (Inception_v3, 14, 8, (299, 299)),
+}
+
+def _load_images(args, image_size):
+    if args.dataset_dir is None:
+        image_paths = [os.path.abspath('./images/example.png')]
+    else:
+        image_paths = [os.path.join(args.dataset_dir, name) for name in sorted(os.listdir(args.dataset_dir))[:args.num_images]]
+    images = [load_image(shape=image_size, data_format='channels_first', fpath=path, abs_path=True) for path in image_paths]
+    return np.stack(images).astype(np.float32)
+
+def _build_attack(attack_name, wrapper, args, precision, channels_last):
+    kwargs = {
+        'device' : args.device,
+        'precision' : precision,
+        'channels_last' : channels_last,
+    }
+    epsilon = args.epsilon / 255.
+    step_size = args.step_size / 255.
+    if attack_name == 'dr':
+        return DispersionAttack_gpu(wrapper, epsilon=epsilon, step_size=step_size, steps=args.steps,
+                                    attack_layer_idx_list=[args.dr_attacklayer], **kwargs)
+    if attack_name == 'pgd':
+        return LinfPGDAttack(wrapper.model, epsilon=epsilon, a=step_size, k=args.steps, random_start=False, **kwargs)
+    if attack_name == 'mifgsm':
+        return MomentumIteratorAttack(wrapper.model, decay_factor=0.5, epsilon=epsilon, step_size=step_size,
+                                      steps=args.steps, random_start=False, **kwargs)
+    if attack_name == 'dim':
+        return DIM_Attack(wrapper.model, decay_factor=1, prob=0.5, epsilon=epsilon, step_size=step_size,
+                          steps=args.steps, image_resize=330, **kwargs)
+    if attack_name == 'tidim':
+        return TIDIM_Attack(wrapper.model, decay_factor=1, prob=0.5, epsilon=epsilon, step_size=step_size,
+                            steps=args.steps, image_resize=330, **kwargs)
+    raise ValueError('Invalid attack.')
+
+def _run_attack(attack, attack_name, images, labels, args, num_internal):
+    ''' adversarial images as numpy, with the attack wall time. '''
+    advs = []
+    start = time.time()
+    for begin in range(0, len(images), args.batch_size):
+        images_batch = torch.from_numpy(images[begin:begin + args.batch_size])
+        if attack_name == 'dr':
+            adv = attack(images_batch.to(args.device), [args.dr_attacklayer], list(range(num_internal)))
+        else:
+            seeds = [args.seed + idx for idx in range(begin, begin + len(images_batch))]
+            adv = attack(images_batch, labels[begin:begin + args.batch_size], seeds=seeds)
+        advs.append(adv.cpu().numpy())
+    return np.concatenate(advs), time.time() - start
+
+def _predict(model, images, args):
+    ''' fp32 NCHW labels of images, the same reference for every mode. '''
+    preds = []
+    with torch.no_grad():
+        for begin in range(0, len(images), args.batch_size):
+            images_batch = torch.from_numpy(images[begin:begin + args.batch_size]).to(args.device)
+            preds.append(model(images_batch).argmax(1).cpu())
+    return torch.cat(preds)
+
+def main():
+    parser = argparse.ArgumentParser(description='Success rate drift of the attack precision modes against fp32.')
+    parser.add_argument('--dataset-dir', help='Folder of clean images, defaults to ./images/example.png.', default=None, type=str)
+    parser.add_argument('--num-images', default=16, type=int)
+    parser.add_argument('--batch-size', default=4, type=int)
+    parser.add_argument('-tm', '--target-model', default='vgg16', choices=sorted(TARGET_MODELS.keys()), type=str)
+    parser.add_argument('--attacks', default=['pgd', 'mifgsm', 'dim', 'tidim', 'dr'], nargs='+', type=str)
+    parser.add_argument('--modes', default=['bf16', 'bf16_cl'], choices=sorted(MODES.keys()), nargs='+', type=str)
+    parser.add_argument('--epsilon', help='Budget in range of 0 - 255.', default=16, type=int)
+    parser.add_argument('--step-size', help='Step size in range of 0 - 255.', default=1, type=float)
+    parser.add_argument('--steps', default=10, type=int)
+    parser.add_argument('--dr-attacklayer', help='DR attack layer idx, defaults to the model default.', default=None, type=int)
+    parser.add_argument('--device', default='cpu', type=str)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--random-weights', help='Seeded random weights instead of the pretrained ones, e.g. offline.', action='store_true')
+    args = parser.parse_args()
+
+    model_class, num_internal, default_layer, image_size = TARGET_MODELS[args.target_model]
+    if args.dr_attacklayer is None:
+        args.dr_attacklayer = default_layer
+    torch.manual_seed(args.seed)
+    wrapper = model_class(device=args.device, pretrained=not args.random_weights)
+    images = _load_images(args, image_size)
+    labels = _predict(wrapper.model, images, args)
+    epsilon = args.epsilon / 255.
+
+    print('{0} images, {1}{2}, {3} steps, eps {4}/255'.format(
+        len(images), args.target_model, ' (random weights)' if args.random_weights else '', args.steps, args.epsilon))
+    print('{0:<8} {1:<8} {2:>8} {3:>8} {4:>10} {5:>10} {6:>8} {7:>8}'.format(
+        'attack', 'mode', 'success', 'drift', 'disagree', 'max |d|', 'linf', 'time'))
+    for attack_name in args.attacks:
+        results = {}
+        for mode in ['fp32'] + [mode for mode in args.modes if mode != 'fp32']:
+            precision, channels_last = MODES[mode]
+            attack = _build_attack(attack_name, wrapper, args, precision, channels_last)
+            advs, attack_time = _run_attack(attack, attack_name, images, labels, args, num_internal)
+            fooled = (_predict(wrapper.model, advs, args) != labels).numpy()
+            linf = np.abs(advs - images).max()
+            # the projection is done in fp32, the budget holds up to rounding.
+            assert linf <= epsilon + 1e-6, 'L-inf budget exceeded in mode {0} : {1}'.format(mode, linf)
+            results[mode] = (advs, fooled, attack_time)
+
+            ref_advs, ref_fooled, ref_time = results['fp32']
+            print('{0:<8} {1:<8} {2:>8.3f} {3:>+8.3f} {4:>10.3f} {5:>10.5f} {6:>8.5f} {7:>7.2f}s ({8:.2f}x)'.format(
+                attack_name, mode, fooled.mean(), fooled.mean() - ref_fooled.mean(),
+                (fooled != ref_fooled).mean(), np.abs(advs - ref_advs).max(), linf,
+                attack_time, ref_time / attack_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import time
+import argparse
+import numpy as np
+
+from models.retina_resnet50.retinanet_resnet_50.utils.compute_overlap import compute_overlap, _compute_overlap_loop
+
+import pdb
+
+
+def _random_boxes(rng, num, dtype):
+    xy = rng.uniform(0, 800, size=(num, 2))
+    wh = rng.uniform(1, 300, size=(num, 2))
+    return np.concatenate([xy, xy + wh], axis=1).astype(dtype)
+
+def _time(fn, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.time() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of compute_overlap against the scalar loop.')
+    parser.add_argument('--num-anchors', default=20000, type=int)
+    parser.add_argument('--num-annotations', default=10, type=int)
+    parser.add_argument('--block-size', default=4096, type=int)
+    parser.add_argument('--repeat', default=5, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    for dtype in [np.float64, np.float32]:
+        anchors = _random_boxes(rng, args.num_anchors, dtype)
+        annotations = _random_boxes(rng, args.num_annotations, dtype)
+
+        expected, loop_time = _time(lambda: _compute_overlap_loop(anchors, annotations), 1)
+        overlaps, vec_time = _time(lambda: compute_overlap(anchors, annotations), args.repeat)
+        overlaps_blocked, blocked_time = _time(lambda: compute_overlap(anchors, annotations, block_size=args.block_size), args.repeat)
+        assert overlaps.dtype == np.float64 and np.array_equal(overlaps, expected)
+        assert np.array_equal(overlaps_blocked, expected)
+
+        print('{0} : {1} x {2} boxes'.format(np.dtype(dtype).name, args.num_anchors, args.num_annotations))
+        print('    loop       : {0:.4f}s'.format(loop_time))
+        print('    vectorised : {0:.4f}s ({1:.0f}x)'.format(vec_time, loop_time / vec_time))
+        print('    blocked    : {0:.4f}s ({1:.0f}x)'.format(blocked_time, loop_time / blocked_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+
+import pdb
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _import_time(module_name, repeat):
+    ''' best wall time of `python -c "import module_name"`, None if the import fails. '''
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        ret = subprocess.call([sys.executable, '-c', 'import ' + module_name], cwd=ROOT_DIR,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if ret != 0:
+            return None
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the script_* entry points.')
+    parser.add_argument('modules', help='Modules to time, defaults to all script_* entry points and utils.', nargs='*')
+    parser.add_argument('--repeat', help='Runs per module, the best one is reported.', default=3, type=int)
+    args = parser.parse_args()
+
+    modules = args.modules
+    if len(modules) == 0:
+        modules = sorted(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(ROOT_DIR, 'script_*.py')))
+        modules += ['utils.image_utils', 'utils.dataset_utils', 'utils.mAP', 'utils.torch_utils']
+
+    baseline = _import_time('os', args.repeat)
+    print('{0:<45} {1:>8.3f}s'.format('(interpreter)', baseline))
+    for module_name in modules:
+        import_time = _import_time(module_name, args.repeat)
+        if import_time is None:
+            print('{0:<45} {1:>9}'.format(module_name, 'failed'))
+        else:
+            print('{0:<45} {1:>8.3f}s'.format(module_name, import_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ from PIL import Image
 
 from image_utils import load_image, save_image, save_bbox_img, numpy_to_bytes
 from torch_utils import numpy_to_variable, variable_to_numpy
-from api_utils import detect_faces_file
+from utils.api_utils import detect_faces_file, configure_response_cache
 from models.vgg import Vgg16
 from models.resnet import Resnet152
 from attacks.dispersion import DispersionAttack_opt, DispersionAttack
@@ -16,6 +16,10 @@ from tqdm import tqdm
 
 import pdb
 
+# repeated runs reuse the responses of the images already sent. The
+# DispersionAttack_opt API probes share utils.api_utils, hence the cache.
+configure_response_cache()
+
 # mAP       dispersion_opt_14       mi-FGSM
 # budget=16       
 # budget=32       
@@ -0,0 +1,96 @@
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from google.cloud.vision_v1.proto import image_annotator_pb2, image_annotator_pb2_grpc
+
+import utils.api_utils as api_utils
+from utils.api_utils import VisionClientPool, VisionRequestExecutor, make_insecure_client, configure_client_pool, detect_label_files
+
+import pdb
+
+
+class _StubImageAnnotator(image_annotator_pb2_grpc.ImageAnnotatorServicer):
+    '''answers every image with one label, the length of its content.'''
+    def __init__(self, fail_first=0, delay=0.05):
+        self.fail_first = fail_first
+        self.delay = delay
+        self.num_calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def BatchAnnotateImages(self, request, context):
+        with self._lock:
+            self.num_calls += 1
+            if self.num_calls <= self.fail_first:
+                context.abort(grpc.StatusCode.UNAVAILABLE, 'stub failure')
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        responses = []
+        for image_request in request.requests:
+            label = image_annotator_pb2.EntityAnnotation(description=str(len(image_request.image.content)), score=1.)
+            responses.append(image_annotator_pb2.AnnotateImageResponse(label_annotations=[label]))
+        return image_annotator_pb2.BatchAnnotateImagesResponse(responses=responses)
+
+def _start_stub_server(servicer):
+    server = grpc.server(ThreadPoolExecutor(max_workers=16))
+    image_annotator_pb2_grpc.add_ImageAnnotatorServicer_to_server(servicer, server)
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+    return server, 'localhost:{0}'.format(port)
+
+def test_batched_and_bounded():
+    servicer = _StubImageAnnotator()
+    server, address = _start_stub_server(servicer)
+    try:
+        pool = VisionClientPool(pool_size=2, client_factory=lambda: make_insecure_client(address))
+        contents = [b'x' * (idx + 1) for idx in range(40)]
+        with VisionRequestExecutor(pool=pool, max_in_flight=2, batch_size=16) as executor:
+            responses = executor.annotate(contents, ['LABEL_DETECTION'])
+        assert [response.label_annotations[0].description for response in responses] == [str(idx + 1) for idx in range(40)]
+        assert servicer.num_calls == 3
+        assert servicer.max_in_flight <= 2
+    finally:
+        server.stop(0)
+
+def test_retry_on_unavailable():
+    servicer = _StubImageAnnotator(fail_first=2)
+    server, address = _start_stub_server(servicer)
+    try:
+        pool = VisionClientPool(client_factory=lambda: make_insecure_client(address))
+        with VisionRequestExecutor(pool=pool, max_retries=3, backoff=0.01) as executor:
+            responses = executor.annotate([b'abc'], ['LABEL_DETECTION'])
+        assert responses[0].label_annotations[0].description == '3'
+        assert servicer.num_calls == 3
+    finally:
+        server.stop(0)
+
+def test_file_helpers():
+    servicer = _StubImageAnnotator(delay=0.)
+    server, address = _start_stub_server(servicer)
+    try:
+        configure_client_pool(client_factory=lambda: make_insecure_client(address))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for idx in range(3):
+                paths.append(os.path.join(temp_dir, '{0}.jpg'.format(idx)))
+                with open(paths[-1], 'wb') as outf:
+                    outf.write(b'x' * (idx + 5))
+            labels_list = detect_label_files(paths)
+        assert [labels[0].description for labels in labels_list] == ['5', '6', '7']
+    finally:
+        api_utils._default_pool = None
+        server.stop(0)
+
+if __name__ == '__main__':
+    test_batched_and_bounded()
+    test_retry_on_unavailable()
+    test_file_helpers()
+    print('done')
@@ -0,0 +1,87 @@
+import numpy as np
+import torch
+
+from attacks.dispersion import DispersionAttack_opt
+
+import pdb
+
+
+# samples are told apart by their mean, far enough apart to survive the budget.
+BASES = [0.1, 0.5, 0.9]
+# std a sample needs to fool _StdTestModel, the last one is out of reach.
+THRESHOLDS = [0.02, 0.04, 1.]
+
+class _IdentityModel(torch.nn.Module):
+    '''the attacked layer is the image itself, so the attack grows its std.'''
+    def prediction(self, x, internal=[], with_pred=True):
+        flat = x.view(x.shape[0], -1)
+        pred = torch.stack([flat.mean(1), -flat.mean(1)], dim=1)
+        return [x], pred
+
+class _StdTestModel(torch.nn.Module):
+    '''labels a sample 1 once its std passes the threshold of its base, records its inputs.'''
+    def __init__(self):
+        super(_StdTestModel, self).__init__()
+        self.inputs = []
+
+    def forward(self, x):
+        self.inputs.append(x.clone())
+        flat = x.view(x.shape[0], -1)
+        sample_idx = [int(np.argmin([abs(mean - base) for base in BASES])) for mean in flat.mean(1).tolist()]
+        thresholds = torch.tensor([THRESHOLDS[idx] for idx in sample_idx])
+        fooled = (flat.std(1) > thresholds).float()
+        return torch.stack([1 - fooled, fooled], dim=1)
+
+def _images():
+    rng = np.random.RandomState(0)
+    images = [base + 0.005 * rng.randn(3, 8, 8) for base in BASES]
+    return torch.from_numpy(np.stack(images).astype(np.float32))
+
+def _attack(images, gt_label, device_optimizer=True):
+    attack = DispersionAttack_opt(_IdentityModel(), epsilon=0.063, learning_rate=2e-3, steps=30,
+                                  is_test_model=True, device_optimizer=device_optimizer, device='cpu')
+    test_model = _StdTestModel()
+    adv, info_dict = attack(images, attack_layer_idx=0, internal=[0], test_steps=1, gt_label=gt_label, test_model=test_model)
+    return adv, info_dict, test_model
+
+def _check_per_sample(device_optimizer):
+    images = _images()
+    adv, info_dict, test_model = _attack(images, [0, 0, 0], device_optimizer=device_optimizer)
+
+    assert len(info_dict['end_epoch']) == len(BASES)
+    assert len(info_dict['det_label']) == len(BASES) and len(info_dict['loss']) == len(BASES)
+    end_epoch = info_dict['end_epoch']
+    # the easier sample is solved first, the last one never.
+    assert end_epoch[0] is not None and end_epoch[1] is not None and end_epoch[0] < end_epoch[1]
+    assert end_epoch[2] is None and info_dict['det_label'][2] is None
+    assert info_dict['det_label'][0] == 1 and info_dict['det_label'][1] == 1
+    # one test_model call per step, on the samples still active at that step.
+    assert [len(x) for x in test_model.inputs] == [3] * (end_epoch[0] + 1) + [2] * (end_epoch[1] - end_epoch[0]) + [1] * (29 - end_epoch[1])
+
+    for idx in range(2):
+        # a solved sample keeps the image test_model saw at its end_epoch.
+        tested = test_model.inputs[end_epoch[idx]]
+        row = int(np.argmin([abs(mean - BASES[idx]) for mean in tested.view(len(tested), -1).mean(1).tolist()]))
+        assert torch.equal(adv[idx], tested[row])
+    # the unsolved sample ran all the steps and ends on the last tested image.
+    assert torch.equal(adv[2], test_model.inputs[-1][0])
+    assert (adv - images).abs().max() <= 0.063 + 1e-6
+
+def test_per_sample_early_stop():
+    _check_per_sample(device_optimizer=True)
+
+def test_per_sample_early_stop_numpy_optimizer():
+    _check_per_sample(device_optimizer=False)
+
+def test_single_image_scalar_label():
+    images = _images()[:1]
+    adv, info_dict, test_model = _attack(images, 0)
+    assert np.ndim(info_dict['end_epoch']) == 0 and info_dict['det_label'] == 1
+    assert torch.equal(adv[0], test_model.inputs[info_dict['end_epoch']][0])
+    assert len(test_model.inputs) == info_dict['end_epoch'] + 1
+
+if __name__ == '__main__':
+    test_per_sample_early_stop()
+    test_per_sample_early_stop_numpy_optimizer()
+    test_single_image_scalar_label()
+    print('done')
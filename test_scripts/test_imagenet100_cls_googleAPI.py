@@ -10,13 +10,17 @@ from models.resnet import Resnet152
 from attacks.dispersion import DispersionAttack_opt, DispersionAttack
 from attacks.mifgsm import MomentumIteratorAttack
 from attacks.DIM import DIM_Attack
-from api_utils import detect_label_numpy
+from utils.api_utils import detect_label_numpy
 import numpy as np
 import torchvision
-from api_utils import detect_label_file
+from utils.api_utils import detect_label_file, detect_label_files, configure_response_cache, VisionRequestExecutor
 import os
 import pdb
 
+# repeated runs reuse the responses of the images already sent. The
+# DispersionAttack_opt API probes share utils.api_utils, hence the cache.
+configure_response_cache()
+
 # Resnet152 [4, 5, 6, 7]
 # Vgg16 [2, 7, 14, 21, 28]
 
@@ -104,32 +108,23 @@ attack = MomentumIteratorAttack(model, decay_factor=1.0, epsilon=16./255, steps=
 
 total_samples = 100
 success_attacks = 0
+ori_paths = []
+adv_paths = []
 for idx, temp_image_name in enumerate(tqdm(images_name)):
     print('idx: ', idx)
+    temp_image_name_noext = os.path.splitext(temp_image_name)[0]
     temp_image_path = os.path.join(dataset_dir, temp_image_name)
     image_np = load_image(data_format='channels_first', abs_path=True, fpath=temp_image_path)
-    Image.fromarray(np.transpose((image_np * 255).astype(np.uint8), (1, 2, 0))).save('./out/ori.jpg')
-    google_label = detect_label_file('./out/ori.jpg')
-    if len(google_label) > 0:
-        pred_cls = google_label[0].description
-    else:
-        pred_cls = None
-    print(pred_cls)
+    ori_paths.append(os.path.join('./out', 'ori_' + temp_image_name_noext + '.jpg'))
+    Image.fromarray(np.transpose((image_np * 255).astype(np.uint8), (1, 2, 0))).save(ori_paths[-1])
     image_torch_nchw = torch.from_numpy(np.expand_dims(image_np, axis=0)).float()
     pred_nat = model(image_torch_nchw.cuda()).detach().cpu().numpy()
     label = np.argmax(pred_nat)
     label_tensor = torch.tensor(np.array([label]))
     adv = attack(image_torch_nchw, label_tensor)
     adv_np = variable_to_numpy(adv)
-    Image.fromarray(np.transpose((adv_np * 255).astype(np.uint8), (1, 2, 0))).save('./out/temp.jpg')
-    google_label = detect_label_file('./out/temp.jpg')
-    if len(google_label) > 0:
-        output_cls = google_label[0].description
-    else:
-        output_cls = None
-    print(output_cls)
-    print(" ")
-    adv_np = variable_to_numpy(adv)
+    adv_paths.append(os.path.join('./out', 'adv_' + temp_image_name_noext + '.jpg'))
+    Image.fromarray(np.transpose((adv_np * 255).astype(np.uint8), (1, 2, 0))).save(adv_paths[-1])
     linf = int(np.max(abs(image_np - adv_np)) * 255)
     print('linf: ', linf)
     l1 = np.mean(abs(image_np - adv_np)) * 255
@@ -137,6 +132,15 @@ for idx, temp_image_name in enumerate(tqdm(images_name)):
     l2 = np.sqrt(np.mean(np.multiply((image_np * 255 - adv_np * 255), (image_np * 255 - adv_np * 255))))
     print('l2: ', l2)
     print(" ")
+
+# clean and adversarial images are labelled at the end, in batched requests.
+with VisionRequestExecutor(max_in_flight=4) as executor:
+    ori_labels_list = detect_label_files(ori_paths, executor=executor)
+    adv_labels_list = detect_label_files(adv_paths, executor=executor)
+for temp_image_name, ori_labels, adv_labels in zip(images_name, ori_labels_list, adv_labels_list):
+    pred_cls = ori_labels[0].description if len(ori_labels) > 0 else None
+    output_cls = adv_labels[0].description if len(adv_labels) > 0 else None
+    print(temp_image_name, ' : ', pred_cls, ' -> ', output_cls)
     if output_cls != pred_cls:
         success_attacks += 1
 print('attack success rate: ', float(success_attacks) / float(total_samples))
@@ -6,7 +6,7 @@ from PIL import Image
 
 from image_utils import load_image, save_image, save_bbox_img, numpy_to_bytes
 from torch_utils import numpy_to_variable, variable_to_numpy
-from api_utils import detect_objects_file, googleDet_to_Dictionary
+from utils.api_utils import detect_objects_file, googleDet_to_Dictionary, configure_response_cache
 from models.vgg import Vgg16
 from models.resnet import Resnet152
 from attacks.dispersion import DispersionAttack_opt, DispersionAttack
@@ -17,6 +17,10 @@ from tqdm import tqdm
 
 import pdb
 
+# repeated runs reuse the responses of the images already sent. The
+# DispersionAttack_opt API probes share utils.api_utils, hence the cache.
+configure_response_cache()
+
 # VGG16
 # mAP       dispersion_opt_12       dispersion_opt_14       mi-FGSM(m=0.5)         DIM(m=0.5)       mi-FGSM(m=1.0)      DIM(m=1.0)      TI-DIM
 # budget=16       37.57                   32.88                 42.06                40.89               42.62              36.52        33.98
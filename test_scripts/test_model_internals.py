@@ -0,0 +1,40 @@
+import torch
+
+from models.vgg import Vgg16
+from models.resnet import Resnet152
+
+import pdb
+
+
+def _models():
+    torch.manual_seed(0)
+    return [(Vgg16(device='cpu', pretrained=False), 14), (Resnet152(device='cpu', pretrained=False), 1)]
+
+def _input():
+    return torch.rand(2, 3, 64, 64, generator=torch.Generator().manual_seed(0))
+
+def test_with_pred_does_not_change_layers():
+    x = _input()
+    for model, layer_idx in _models():
+        with torch.no_grad():
+            layers, pred = model.prediction(x, internal=[layer_idx], with_pred=True)
+            layers_stopped, pred_stopped = model.prediction(x, internal=[layer_idx], with_pred=False)
+        assert pred is not None and pred_stopped is None
+        # the in-place ReLU following the layer runs in both passes.
+        assert layers[0].min() >= 0
+        assert torch.equal(layers[0], layers_stopped[0])
+
+def test_truncate_matches_full_pass():
+    x = _input()
+    for model, _ in _models():
+        num_layers = 29 if isinstance(model, Vgg16) else len(model.features) - 1
+        for layer_idx in range(num_layers):
+            with torch.no_grad():
+                layers, _ = model.prediction(x, internal=[layer_idx])
+                truncated = model.truncate([layer_idx])(x)
+            assert torch.equal(truncated[0], layers[0]), layer_idx
+
+if __name__ == '__main__':
+    test_with_pred_does_not_change_layers()
+    test_truncate_matches_full_pass()
+    print('done')
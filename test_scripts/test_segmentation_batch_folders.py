@@ -0,0 +1,34 @@
+from script_evaluate_segmentation_pytorch import _folder_chunks
+
+import pdb
+
+
+FOLDERS = ['folder_{0}'.format(idx) for idx in range(10)]
+
+def _check_chunks(with_ori, max_batch_size=8):
+    adv_paths = ['{0}/img.png'.format(curt_folder) for curt_folder in FOLDERS]
+    img_paths = (['ori/img.jpg'] if with_ori else []) + adv_paths
+    chunks = list(_folder_chunks(img_paths, FOLDERS, max_batch_size, with_ori))
+
+    assert [path for chunk_paths, _ in chunks for path in chunk_paths] == img_paths
+    assert [curt_folder for _, chunk_folders in chunks for curt_folder in chunk_folders] == FOLDERS
+    for chunk_idx, (chunk_paths, chunk_folders) in enumerate(chunks):
+        assert len(chunk_paths) <= max_batch_size
+        # the clean image only leads the first chunk and has no folder.
+        adv_chunk_paths = chunk_paths[1:] if with_ori and chunk_idx == 0 else chunk_paths
+        assert adv_chunk_paths == ['{0}/img.png'.format(curt_folder) for curt_folder in chunk_folders]
+
+def test_folder_chunks_with_ori():
+    _check_chunks(with_ori=True)
+
+def test_folder_chunks_cached_ori():
+    _check_chunks(with_ori=False)
+
+def test_folder_chunks_batch_size_one():
+    _check_chunks(with_ori=True, max_batch_size=1)
+
+if __name__ == '__main__':
+    test_folder_chunks_with_ori()
+    test_folder_chunks_cached_ori()
+    test_folder_chunks_batch_size_one()
+    print('done')
@@ -0,0 +1,25 @@
+import numpy as np
+import torch
+
+from attacks.ti_dim import TIDIM_Attack
+
+import pdb
+
+
+def _smoothing_error(separable_kernel):
+    device = torch.device('cuda:0') if torch.cuda.is_available() else torch.device('cpu')
+    attack = TIDIM_Attack(torch.nn.Sequential(), separable_kernel=separable_kernel, device=device)
+    grad = np.random.RandomState(0).randn(2, 3, 224, 224).astype(np.float32)
+    expected = attack.depthwise_conv2d(grad, attack.stack_kernel)
+    out = attack.smooth_gradient(torch.from_numpy(grad).to(device)).cpu().numpy()
+    return np.abs(out - expected).max() / np.abs(expected).max()
+
+def test_smooth_gradient():
+    assert _smoothing_error(False) < 1e-5
+
+def test_smooth_gradient_separable():
+    assert _smoothing_error(True) < 1e-5
+
+if __name__ == '__main__':
+    print('full kernel relative error: ', _smoothing_error(False))
+    print('separable kernel relative error: ', _smoothing_error(True))
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+
+tf = pytest.importorskip('tensorflow')
+K = pytest.importorskip('keras.backend')
+
+import pdb
+
+
+# different sizes, so batch_predict pads them to the largest one.
+IMAGE_PATHS = ['images/cat.jpg', 'images/05097.jpg', 'images/origin.jpg']
+
+def _sorted_detections(prediction):
+    order = sorted(range(len(prediction['classes'])), key=lambda idx: (prediction['classes'][idx], -prediction['scores'][idx]))
+    boxes = np.array([prediction['boxes'][idx] for idx in order], dtype=np.float32).reshape(-1, 4)
+    scores = np.array([prediction['scores'][idx] for idx in order], dtype=np.float32)
+    classes = [int(prediction['classes'][idx]) for idx in order]
+    return boxes, scores, classes
+
+def test_batch_predict_matches_predict():
+    from models.yolov3.yolov3_wrapper import YOLOv3
+    if not os.path.exists(YOLOv3._defaults['model_path']):
+        pytest.skip('YOLOv3 weights not found.')
+    model = YOLOv3(sess=K.get_session())
+    images = [Image.open(path).convert('RGB') for path in IMAGE_PATHS]
+    assert len(set(image.size for image in images)) == len(images)
+
+    batch_predictions = model.batch_predict(images)
+    assert len(batch_predictions) == len(images)
+    for image, batch_prediction in zip(images, batch_predictions):
+        boxes, scores, classes = _sorted_detections(model.predict(image))
+        batch_boxes, batch_scores, batch_classes = _sorted_detections(batch_prediction)
+        assert batch_classes == classes
+        assert np.allclose(batch_boxes, boxes, atol=1e-2)
+        assert np.allclose(batch_scores, scores, atol=1e-4)
+
+if __name__ == '__main__':
+    test_batch_predict_matches_predict()
+    print('done')
@@ -1,4 +1,3 @@
-from pycocotools.coco import COCO
 import os
 import numpy as np
 import cv2
@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+import pdb
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'bbox_std', 'vision_responses.sqlite')
+
+class VisionResponseCache(object):
+    '''Content addressed on-disk cache of Google Vision responses.
+
+    Serialized responses are stored in a SQLite file keyed by (endpoint,
+    sha1 of the image bytes), endpoint being the annotation type(s) asked
+    for. When the stored responses grow past max_bytes, the least recently
+    used ones are evicted down to evict_ratio * max_bytes. Safe to share
+    between threads.
+    '''
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=256 << 20, evict_ratio=0.8):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_ratio = evict_ratio
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'endpoint TEXT NOT NULL, image_hash TEXT NOT NULL, response BLOB NOT NULL, '
+            'size INTEGER NOT NULL, last_access REAL NOT NULL, '
+            'PRIMARY KEY (endpoint, image_hash))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        with self._lock:
+            self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def image_hash(content):
+        return hashlib.sha1(content).hexdigest()
+
+    def get(self, endpoint, content):
+        '''serialized response, None on a miss.'''
+        key = (endpoint, self.image_hash(content))
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response FROM responses WHERE endpoint = ? AND image_hash = ?', key).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                'UPDATE responses SET last_access = ? WHERE endpoint = ? AND image_hash = ?', (time.time(),) + key)
+        return bytes(row[0])
+
+    def put(self, endpoint, content, response):
+        key = (endpoint, self.image_hash(content))
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size FROM responses WHERE endpoint = ? AND image_hash = ?', key).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                key + (sqlite3.Binary(response), len(response), time.time()))
+            self._total_bytes += len(response)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.evict_ratio * self.max_bytes
+        rows = self._conn.execute('SELECT endpoint, image_hash, size FROM responses ORDER BY last_access').fetchall()
+        evicted = []
+        for endpoint, image_hash, size in rows:
+            if self._total_bytes <= target:
+                break
+            evicted.append((endpoint, image_hash))
+            self._total_bytes -= size
+        self._conn.executemany('DELETE FROM responses WHERE endpoint = ? AND image_hash = ?', evicted)
+
+    def get_or_call(self, endpoint, content, call_fn, parse_fn):
+        '''cached response of content, call_fn() is only called on a miss.
+
+        call_fn returns a response message, parse_fn builds one from its
+        serialized bytes. Responses carrying an error are not cached.
+        '''
+        cached = self.get(endpoint, content)
+        if cached is not None:
+            return parse_fn(cached)
+        response = call_fn()
+        if response.error.code == 0:
+            self.put(endpoint, content, response.SerializeToString())
+        return response
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
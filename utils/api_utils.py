@@ -1,10 +1,214 @@
 from google.cloud import vision
 from google.cloud.vision import types
+from google.api_core import exceptions as api_exceptions
 import io
+import time
+import random
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from utils.api_cache import VisionResponseCache, DEFAULT_CACHE_PATH
 import pdb
 
+# max images per batch_annotate_images request accepted by the API.
+MAX_BATCH_SIZE = 16
+
+RETRYABLE_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.InternalServerError,
+)
+
+
+def make_insecure_client(address):
+    """ImageAnnotatorClient talking plain gRPC to address, e.g. a local stub server."""
+    import grpc
+    from google.cloud.vision_v1.gapic.transports.image_annotator_grpc_transport import ImageAnnotatorGrpcTransport
+    channel = grpc.insecure_channel(address)
+    return vision.ImageAnnotatorClient(transport=ImageAnnotatorGrpcTransport(channel=channel))
+
+
+class VisionClientPool(object):
+    """Round robin pool of long lived ImageAnnotatorClients.
+
+    Each client owns one channel, so the connection and TLS handshake are
+    paid once per client instead of once per request. Clients are thread
+    safe and are handed out to any number of callers.
+    """
+    def __init__(self, pool_size=1, client_factory=None):
+        if client_factory is None:
+            client_factory = vision.ImageAnnotatorClient
+        self.clients = [client_factory() for _ in range(pool_size)]
+        self._next = itertools.cycle(self.clients)
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            return next(self._next)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def configure_client_pool(pool_size=1, client_factory=None):
+    """Replace the pool shared by all helpers of this module, e.g. to point them to a stub server."""
+    global _default_pool
+    with _default_pool_lock:
+        _default_pool = VisionClientPool(pool_size=pool_size, client_factory=client_factory)
+    return _default_pool
+
+def get_client_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = VisionClientPool()
+        return _default_pool
+
+def get_client():
+    return get_client_pool().get()
+
+
+_response_cache = None
+
+def configure_response_cache(path=DEFAULT_CACHE_PATH, max_bytes=256 << 20):
+    """Cache the responses of the helpers of this module on disk, path=None turns the cache off."""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = VisionResponseCache(path, max_bytes=max_bytes) if path is not None else None
+    return _response_cache
+
+def _annotate_cached(endpoint, content, call_fn):
+    if _response_cache is None:
+        return call_fn()
+    return _response_cache.get_or_call(endpoint, content, call_fn, types.AnnotateImageResponse.FromString)
+
+def _endpoint_name(features):
+    return '+'.join(sorted('{0}:{1}'.format(feature.type, feature.max_results) for feature in features))
+
+
+def _feature(feature_type, max_results=None):
+    if isinstance(feature_type, str):
+        feature_type = getattr(vision.enums.Feature.Type, feature_type.upper())
+    if max_results is None:
+        return types.Feature(type=feature_type)
+    return types.Feature(type=feature_type, max_results=max_results)
+
+
+class VisionRequestExecutor(object):
+    """Threaded batch-annotate executor on top of a VisionClientPool.
+
+    Images are grouped batch_size at a time into batch_annotate_images
+    requests, at most max_in_flight requests run at a time and submit
+    blocks when that many are pending. Requests failing with a transient
+    error are retried max_retries times with exponential backoff.
+
+    Example:
+        with VisionRequestExecutor(max_in_flight=8) as executor:
+            responses = executor.annotate_files(paths, ['LABEL_DETECTION'])
+    """
+    def __init__(self, pool=None, max_in_flight=8, batch_size=MAX_BATCH_SIZE, max_retries=3, backoff=0.5, max_backoff=16., timeout=None):
+        assert 1 <= batch_size <= MAX_BATCH_SIZE
+        self.pool = pool if pool is not None else get_client_pool()
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # retries are handled here instead of by the client's default retry.
+        self._call_kwargs = {'retry' : None}
+        if timeout is not None:
+            self._call_kwargs['timeout'] = timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def _run(self, requests):
+        try:
+            for attempt in itertools.count():
+                try:
+                    response = self.pool.get().batch_annotate_images(requests, **self._call_kwargs)
+                    return list(response.responses)
+                except RETRYABLE_ERRORS:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+                    time.sleep(delay * (0.5 + random.random() / 2.))
+        finally:
+            self._slots.release()
+
+    def submit(self, contents, features):
+        """future of the AnnotateImageResponses of one batch of encoded images."""
+        assert len(contents) <= self.batch_size
+        features = [feature if isinstance(feature, types.Feature) else _feature(feature) for feature in features]
+        requests = [types.AnnotateImageRequest(image=types.Image(content=content), features=features)
+                    for content in contents]
+        self._slots.acquire()
+        try:
+            return self._executor.submit(self._run, requests)
+        except:
+            self._slots.release()
+            raise
+
+    def annotate(self, contents, features):
+        """AnnotateImageResponses of all encoded images, in input order.
+
+        Per image failures are reported in each response's error field.
+        With a response cache configured, only the cache misses are sent.
+        """
+        contents = list(contents)
+        features = [feature if isinstance(feature, types.Feature) else _feature(feature) for feature in features]
+        endpoint = _endpoint_name(features)
+        responses = [None] * len(contents)
+        if _response_cache is not None:
+            for idx, content in enumerate(contents):
+                cached = _response_cache.get(endpoint, content)
+                if cached is not None:
+                    responses[idx] = types.AnnotateImageResponse.FromString(cached)
+        missed = [idx for idx, response in enumerate(responses) if response is None]
+        futures = [self.submit([contents[idx] for idx in missed[start : start + self.batch_size]], features)
+                   for start in range(0, len(missed), self.batch_size)]
+        for start, future in zip(range(0, len(missed), self.batch_size), futures):
+            for idx, response in zip(missed[start : start + self.batch_size], future.result()):
+                responses[idx] = response
+                if _response_cache is not None and response.error.code == 0:
+                    _response_cache.put(endpoint, contents[idx], response.SerializeToString())
+        return responses
+
+    def annotate_files(self, paths, features):
+        contents = []
+        for path in paths:
+            with io.open(path, 'rb') as image_file:
+                contents.append(image_file.read())
+        return self.annotate(contents, features)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def detect_label_files(paths, executor=None):
+    """batched detect_label_file, label annotations of each image file, [] for failed images."""
+    labels_list = _annotate_files(paths, 'LABEL_DETECTION', 'label_annotations', executor)
+    return [labels if labels is not None else [] for labels in labels_list]
+
+def detect_objects_files(paths, executor=None):
+    """batched detect_objects_file, localized object annotations of each image file, None for failed images."""
+    return _annotate_files(paths, 'OBJECT_LOCALIZATION', 'localized_object_annotations', executor)
+
+def _annotate_files(paths, feature, field, executor):
+    if executor is None:
+        with VisionRequestExecutor() as executor:
+            return _annotate_files(paths, feature, field, executor)
+    responses = executor.annotate_files(paths, [feature])
+    return [list(getattr(response, field)) if response.error.code == 0 else None for response in responses]
+
 def detect_label_numpy(image):
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     # Performs label detection on the image file
     response = client.label_detection(image=image)
@@ -14,15 +218,20 @@ def detect_label_numpy(image):
     return None
 
 def detect_label_file(path):
-    client = vision.ImageAnnotatorClient()
-
     # The name of the image file to annotate
     with io.open(path, 'rb') as image_file:
         content = image_file.read()
     image = types.Image(content=content)
-    # Performs label detection on the image file
+    return detect_label_image(image)
+
+def detect_label_image(image):
+    """detect_label_file on an in-memory types.Image, e.g. from numpy_to_bytes."""
+    client = get_client()
+
+    # Performs label detection on the image
     try:
-        response = client.label_detection(image=image)
+        response = _annotate_cached(_endpoint_name([_feature('LABEL_DETECTION')]), image.content,
+                                    lambda: client.label_detection(image=image))
     except:
         return []
     labels = response.label_annotations
@@ -31,7 +240,7 @@ def detect_label_file(path):
 
 def detect_objects_numpy(image):
 
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
     objects = client.object_localization(
         image=image).localized_object_annotations
 
@@ -48,14 +257,14 @@ def detect_objects_file(path):
     path: The path to the local file.
     """
     from google.cloud import vision
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     with open(path, 'rb') as image_file:
         content = image_file.read()
     image = vision.types.Image(content=content)
     try:
-        objects = client.object_localization(
-            image=image).localized_object_annotations
+        objects = _annotate_cached(_endpoint_name([_feature('OBJECT_LOCALIZATION')]), content,
+                                   lambda: client.object_localization(image=image)).localized_object_annotations
     except:
         objects = None
 
@@ -74,7 +283,7 @@ def detect_objects_file(path):
 def detect_text_numpy(image):
     """Detects text in the file."""
     from google.cloud import vision
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     response = client.text_detection(image=image)
     texts = response.text_annotations
@@ -86,7 +295,7 @@ def detect_text_numpy(image):
 def detect_text_file(path):
     """Detects text in the file."""
     from google.cloud import vision
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     with io.open(path, 'rb') as image_file:
         content = image_file.read()
@@ -107,7 +316,7 @@ def detect_text_file(path):
 
 def detect_safe_search_numpy(image):
     from google.cloud import vision
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     response = client.safe_search_detection(image=image)
     safe = response.safe_search_annotation
@@ -117,7 +326,7 @@ def detect_safe_search_numpy(image):
 def detect_safe_search_file(path):
     """Detects unsafe features in the file."""
     from google.cloud import vision
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     with io.open(path, 'rb') as image_file:
         content = image_file.read()
@@ -141,7 +350,7 @@ def detect_safe_search_file(path):
 def detect_faces_numpy(image):
     """Detects faces in an image."""
     from google.cloud import vision
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     response = client.face_detection(image=image)
     faces = response.face_annotations
@@ -157,14 +366,15 @@ def detect_faces_numpy(image):
 def detect_faces_file(path):
     """Detects faces in an image."""
     from google.cloud import vision
-    client = vision.ImageAnnotatorClient()
+    client = get_client()
 
     with io.open(path, 'rb') as image_file:
         content = image_file.read()
 
     image = vision.types.Image(content=content)
 
-    response = client.face_detection(image=image)
+    response = _annotate_cached(_endpoint_name([_feature('FACE_DETECTION')]), content,
+                                lambda: client.face_detection(image=image))
     faces = response.face_annotations
 
     out_dic = {}
@@ -2,6 +2,8 @@ import numpy as np
 import os
 import shutil
 import glob
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import pdb
 
@@ -17,6 +19,61 @@ def generate_FDDB_testdata(input_dir, output_dir, num_imgs=100):
     for idx, temp_path in enumerate(selected_image_paths):
         shutil.copyfile(temp_path, os.path.join(output_dir, 'img_choice_{0:03d}.jpg'.format(idx)))
     
+def _load_image_file(fpath, shape, data_format):
+    from utils.image_utils import load_image
+    return load_image(shape=shape, data_format=data_format, abs_path=True, fpath=fpath)
+
+class PrefetchImageLoader(object):
+    '''Iterates over (images_np, names) batches of the images in input_dir.
+
+    Images are decoded and resized by a pool of workers (threads, or processes
+    with use_processes=True) up to prefetch_batches batches ahead of the
+    consumer. images_np stacks exactly what load_image returns for each
+    image; with pin_memory=True its buffer is page-locked torch memory so
+    that host to device copies can be asynchronous. Files are taken in
+    sorted order, the last batch holds the remaining images.
+    '''
+    def __init__(self, input_dir, batch_size, shape=(224, 224), data_format='channels_first', 
+                 image_names=None, num_workers=4, prefetch_batches=2, use_processes=False, pin_memory=False):
+        assert batch_size > 0
+        if image_names is None:
+            image_names = sorted(os.listdir(input_dir))
+        self.input_dir = input_dir
+        self.image_names = list(image_names)
+        self.batch_size = batch_size
+        self.shape = shape
+        self.data_format = data_format
+        self.num_workers = num_workers
+        self.prefetch_batches = prefetch_batches
+        self.use_processes = use_processes
+        self.pin_memory = pin_memory
+
+    def __len__(self):
+        return (len(self.image_names) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        name_batches = iter([self.image_names[idx : idx + self.batch_size] for idx in range(0, len(self.image_names), self.batch_size)])
+        executor_cls = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        with executor_cls(max_workers=self.num_workers) as executor:
+            pending = collections.deque()
+            def _submit_next():
+                names = next(name_batches, None)
+                if names is None:
+                    return
+                futures = [executor.submit(_load_image_file, os.path.join(self.input_dir, name), self.shape, self.data_format) for name in names]
+                pending.append((names, futures))
+
+            for _ in range(self.prefetch_batches + 1):
+                _submit_next()
+            while len(pending) > 0:
+                names, futures = pending.popleft()
+                _submit_next()
+                images_np = np.array([future.result() for future in futures])
+                if self.pin_memory:
+                    import torch
+                    images_np = torch.from_numpy(images_np).pin_memory().numpy()
+                yield images_np, names
+
 
 if __name__ == "__main__":
     #generate_imagenet_testdata("/home/yantao/datasets/ILSVRC/Data/DET/test/", "/home/yantao/datasets/imagenet_100image/")
@@ -1,11 +1,11 @@
 from PIL import Image, ImageFont, ImageDraw
 import numpy as np
 from io import BytesIO
-from google.cloud.vision import types
-import matplotlib.pyplot as plt
-from tqdm import tqdm
-import cv2
 import os
+import threading
+import functools
+import colorsys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import pdb
 
@@ -54,6 +54,93 @@ def save_image(image):
         image = (image * 255).astype(np.uint8)
     Image.fromarray(image).save("./out/test.jpg")    
 
+def _encode_and_save(image, path, codec, png_compress_level):
+    image = np.transpose((image * 255).astype(np.uint8), (1, 2, 0))
+    # written aside and renamed, an interrupted run never leaves a partial file.
+    temp_path = path + '.tmp'
+    if codec == 'png':
+        Image.fromarray(image).save(temp_path, format='PNG', compress_level=png_compress_level)
+    else:
+        with open(temp_path, 'wb') as outf:
+            np.save(outf, image)
+    os.replace(temp_path, path)
+
+class AsyncImageWriter(object):
+    '''Encodes and saves channels_first [0, 1] images in the background.
+
+    codec is 'png' or 'npy'; 'npy' stores the same uint8 HWC array the png
+    would hold, without compression. The evaluation scripts only read png
+    outputs, npy ones have to be converted before they can be evaluated.
+    write() blocks while max_pending
+    images are still waiting to be saved, so memory stays bounded. Errors
+    raised by the workers are re-raised by close().
+    '''
+    CODEC_EXT = {'png' : '.png', 'npy' : '.npy'}
+
+    def __init__(self, output_dir, codec='png', png_compress_level=6, num_workers=2, max_pending=64, use_processes=False):
+        self.output_dir = output_dir
+        self.codec = codec
+        self.png_compress_level = png_compress_level
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor_cls(max_workers=num_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def output_path(self, name):
+        return os.path.join(self.output_dir, os.path.splitext(name)[0] + self.CODEC_EXT[self.codec])
+
+    def has_valid_output(self, name):
+        path = self.output_path(name)
+        if not os.path.isfile(path):
+            return False
+        try:
+            if self.codec == 'png':
+                with Image.open(path) as image:
+                    image.verify()
+            else:
+                np.load(path, mmap_mode='r')
+        except Exception:
+            return False
+        return True
+
+    def remove_temp_outputs(self, names):
+        '''delete the partial files a crashed run left behind for names.
+
+        Only the files of names are touched, so shards sharing the folder
+        do not remove each other's in-progress writes.
+        '''
+        for name in names:
+            temp_path = self.output_path(name) + '.tmp'
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    def write(self, images, names):
+        for image, name in zip(images, names):
+            self._slots.acquire()
+            future = self._executor.submit(_encode_and_save, image, self.output_path(name), self.codec, self.png_compress_level)
+            future.add_done_callback(lambda _: self._slots.release())
+            self._futures.append(future)
+        self._check_done()
+
+    def _check_done(self):
+        pending = []
+        for future in self._futures:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self._futures = pending
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._check_done()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 def numpy_to_bytes(image, format='JPEG'):
     if image.shape[0] == 3:
         image = np.transpose(image, (1, 2, 0))
@@ -63,6 +150,7 @@ def numpy_to_bytes(image, format='JPEG'):
     byte_io = BytesIO()
     image.save(byte_io, format=format)
     image = byte_io.getvalue()
+    from google.cloud.vision import types
     image = types.Image(content=image)
     return image
 
@@ -210,39 +298,47 @@ def draw_masks(image, mask, num_classes, from_path=True, out_file='temp_mask_img
     from PIL import Image
     from PIL import ImageFont
     from PIL import ImageDraw
-    import colorsys
 
     if from_path:
         source_img = Image.open(image).convert("RGB")
     else:
         source_img = Image.fromarray(image)
 
-    image = source_img.copy()
-
-    def _init_color(random_seed, num_classes):
-        # Generate colors for drawing bounding boxes.
-        hsv_tuples = [(x / num_classes, 1., 1.)
-                      for x in range(num_classes)]
-        colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
-        colors = list(
-            map(lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)),
-                colors))
-        np.random.seed(random_seed)  # Fixed seed for colors across runs.
-        np.random.shuffle(colors)  # Shuffle to decorrelate adjacent classes.
-        np.random.seed(None)  # Reset seed to default.
-        return colors
-
-    colors = _init_color(10101, num_classes)
-    mask_rgb = np.zeros((mask.shape[0], mask.shape[1], 3)).astype(np.uint8)
-    for h in range(mask_rgb.shape[0]):
-        for w in range(mask_rgb.shape[1]):
-            mask_rgb[h, w] = colors[mask[h, w]]
-
-    mask_img = 0.5 * np.array(image).astype(np.int32) + 0.5 * mask_rgb.astype(np.int32)
+    mask_rgb = _mask_palette(num_classes)[mask]
+    # floor((a + b) / 2), the same as the truncated 0.5 * a + 0.5 * b.
+    mask_img = (np.asarray(source_img, dtype=np.uint16) + mask_rgb) >> 1
     Image.fromarray(mask_img.astype(np.uint8)).save(out_file)
     return
 
+@functools.lru_cache(maxsize=None)
+def _mask_palette(num_classes, random_seed=10101):
+    """(num_classes, 3) uint8 lookup table of the mask colors."""
+    # Generate colors for drawing bounding boxes.
+    hsv_tuples = [(x / num_classes, 1., 1.)
+                  for x in range(num_classes)]
+    colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
+    colors = list(
+        map(lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)),
+            colors))
+    # Fixed seed for colors across runs, shuffle to decorrelate adjacent classes.
+    np.random.RandomState(random_seed).shuffle(colors)
+    palette = np.array(colors, dtype=np.uint8)
+    palette.setflags(write=False)
+    return palette
+
+def draw_masks_batch(images, masks, num_classes, out_files, from_path=True, num_workers=4):
+    """Draw many output masks on images, in num_workers processes."""
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(draw_masks, image, mask, num_classes, from_path=from_path, out_file=out_file) 
+                   for image, mask, out_file in zip(images, masks, out_files)]
+        for future in futures:
+            future.result()
+    return
+
 def visualize_features(intermediate_features, output_dir, file_prefix='', data_format='channels_last', image_size=(224, 224), only_first_channel=True):
+    import matplotlib.pyplot as plt
+    from tqdm import tqdm
+
     if data_format == 'channels_last':
         intermediate_features = np.transpose(intermediate_features, (2, 0, 1))
     
@@ -256,6 +352,10 @@ def visualize_features(intermediate_features, output_dir, file_prefix='', data_f
         plt.close()
 
 def visualize_features_compare(ori_features, adv_features, output_dir, file_prefix='', data_format='channels_last', image_size=(224, 224), only_first_channel=True):
+    import matplotlib.pyplot as plt
+    from tqdm import tqdm
+    import cv2
+
     if data_format == 'channels_last':
         ori_features = np.transpose(ori_features, (2, 0, 1))
         adv_features = np.transpose(adv_features, (2, 0, 1))
@@ -200,6 +200,155 @@ def calculate_mAP_from_files(gt_dir, pd_dir, min_overlap=0.5):
     shutil.rmtree(TEMP_FILES_PATH)
     return mAP
 
+def calculate_mAP(gt_dic_dict, pd_dic_dict, min_overlap=0.5):
+    """
+    In-memory version of calculate_mAP_from_files, with the same results.
+    gt_dic_dict and pd_dic_dict map an image id (the file name without
+    extension) to the {'boxes', 'scores', 'classes'} dictionary that
+    save_detection_to_file would have written for that image.
+    """
+    # same image order as the sorted file lists.
+    image_ids = sorted(set(gt_dic_dict.keys()) | set(pd_dic_dict.keys()), key=lambda x : x + '.txt')
+
+    """
+    ground-truth
+        Group the ground-truth boxes by (class, image).
+    """
+    gt_boxes_dict = {}
+    gt_counter_per_class = {}
+    for image_id in image_ids:
+        if image_id not in gt_dic_dict:
+            continue
+        classes, boxes, _ = _detection_to_arrays(gt_dic_dict[image_id])
+        for class_name in np.unique(classes):
+            class_boxes = boxes[classes == class_name]
+            gt_boxes_dict[(class_name, image_id)] = class_boxes
+            gt_counter_per_class[class_name] = gt_counter_per_class.get(class_name, 0) + len(class_boxes)
+
+    """
+    detection-results
+        Concatenate the detections of all images, keeping the file order.
+    """
+    pd_classes_list, pd_boxes_list, pd_confidences_list, pd_image_idx_list = [], [], [], []
+    for image_idx, image_id in enumerate(image_ids):
+        if image_id not in pd_dic_dict:
+            continue
+        classes, boxes, confidences = _detection_to_arrays(pd_dic_dict[image_id])
+        pd_classes_list.append(classes)
+        pd_boxes_list.append(boxes)
+        pd_confidences_list.append(confidences)
+        pd_image_idx_list.append(np.full(len(classes), image_idx))
+    pd_classes = np.concatenate(pd_classes_list + [np.zeros(0, dtype=str)])
+    pd_boxes = np.concatenate(pd_boxes_list + [np.zeros((0, 4))])
+    pd_confidences = np.concatenate(pd_confidences_list + [np.zeros(0)])
+    pd_image_idx = np.concatenate(pd_image_idx_list + [np.zeros(0, dtype=int)])
+    for class_name in np.unique(pd_classes):
+        if class_name not in gt_counter_per_class:
+            gt_counter_per_class[class_name] = 0
+
+    gt_classes = sorted(gt_counter_per_class.keys())
+    n_classes = len(gt_classes)
+
+    """
+    Calculate the AP for each class
+    """
+    sum_AP = 0.0
+    for class_name in gt_classes:
+        class_mask = pd_classes == class_name
+        # sort detection-results by decreasing confidence, ties keep the file order.
+        order = np.argsort(-pd_confidences[class_mask], kind='stable')
+        class_boxes = pd_boxes[class_mask][order]
+        class_image_idx = pd_image_idx[class_mask][order]
+
+        """
+        Assign detection-results to ground-truth objects
+            The best overlapping ground-truth box of a detection does not
+            depend on earlier assignments, only the first (most confident)
+            detection matched to a box is a true positive.
+        """
+        nd = len(class_boxes)
+        matched_gt = np.full(nd, -1)
+        gt_offset = 0
+        for image_idx in np.unique(class_image_idx):
+            gt_boxes = gt_boxes_dict.get((class_name, image_ids[image_idx]))
+            if gt_boxes is None:
+                continue
+            det_idx = np.nonzero(class_image_idx == image_idx)[0]
+            ovmax, gt_match = _match_boxes(class_boxes[det_idx], gt_boxes)
+            is_matched = ovmax >= min_overlap
+            matched_gt[det_idx[is_matched]] = gt_match[is_matched] + gt_offset
+            gt_offset += len(gt_boxes)
+
+        tp = np.zeros(nd, dtype=int)
+        matched_idx = np.nonzero(matched_gt >= 0)[0]
+        _, first_idx = np.unique(matched_gt[matched_idx], return_index=True)
+        tp[matched_idx[first_idx]] = 1
+        fp = 1 - tp
+
+        # compute precision/recall
+        tp = np.cumsum(tp)
+        fp = np.cumsum(fp)
+        if gt_counter_per_class[class_name] == 0:
+            rec = np.zeros(nd)
+        else:
+            rec = tp / float(gt_counter_per_class[class_name])
+        prec = tp / (fp + tp)
+
+        ap = _voc_ap_vectorized(rec, prec)
+        sum_AP += ap
+
+    mAP = sum_AP / n_classes
+    text = "mAP = {0:.2f}%".format(mAP*100)
+    print(text)
+    return mAP
+
+def _detection_to_arrays(input_dic):
+    '''classes, [left, top, right, bottom] boxes and confidences of a detection
+    dictionary, converted exactly as save_detection_to_file writes them.
+    '''
+    if not input_dic:
+        return np.zeros(0, dtype=str), np.zeros((0, 4)), np.zeros(0)
+    classes = np.array([str(temp_class) for temp_class in input_dic['classes']], dtype=str)
+    boxes = np.trunc(np.array(input_dic['boxes'], dtype=np.float64).reshape(-1, 4))
+    boxes = boxes[:, [1, 0, 3, 2]]
+    confidences = np.array([float(str(temp_score)) for temp_score in input_dic['scores']], dtype=np.float64)
+    return classes, boxes, confidences
+
+def _match_boxes(bb, bbgt):
+    '''best overlapping ground-truth box of every detection, with the +1
+    pixel convention. Returns (ovmax, gt_match), -1 where nothing overlaps.
+    '''
+    bb = bb[:, None, :]
+    bbgt = bbgt[None, :, :]
+    iw = np.minimum(bb[..., 2], bbgt[..., 2]) - np.maximum(bb[..., 0], bbgt[..., 0]) + 1
+    ih = np.minimum(bb[..., 3], bbgt[..., 3]) - np.maximum(bb[..., 1], bbgt[..., 1]) + 1
+    overlapped = (iw > 0) & (ih > 0)
+    ua = (bb[..., 2] - bb[..., 0] + 1) * (bb[..., 3] - bb[..., 1] + 1) + (bbgt[..., 2] - bbgt[..., 0]
+                    + 1) * (bbgt[..., 3] - bbgt[..., 1] + 1) - iw * ih
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ov = np.where(overlapped, iw * ih / ua, -np.inf)
+    # argmax keeps the first maximum, as the strict comparison of the loop.
+    gt_match = np.argmax(ov, axis=1)
+    ovmax = ov[np.arange(len(ov)), gt_match]
+    no_match = ~(ovmax > -1)
+    ovmax[no_match] = -1
+    gt_match[no_match] = -1
+    return ovmax, gt_match
+
+def _voc_ap_vectorized(rec, prec):
+    """
+    voc_ap on numpy arrays. The final sum is a cumulative sum so that the
+    terms are added in the same order as in voc_ap.
+    """
+    mrec = np.concatenate(([0.0], rec, [1.0]))
+    mpre = np.concatenate(([0.0], prec, [0.0]))
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+    i_list = np.nonzero(mrec[1:] != mrec[:-1])[0] + 1
+    terms = (mrec[i_list] - mrec[i_list - 1]) * mpre[i_list]
+    if len(terms) == 0:
+        return 0.0
+    return float(np.cumsum(terms)[-1])
+
 def _file_lines_to_list(path):
     # open txt file lines to a list
     with open(path) as f:
@@ -0,0 +1,100 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+import pdb
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'bbox_std', 'predictions')
+
+def hash_file(path, chunk_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as inf:
+        for chunk in iter(lambda: inf.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def hash_arrays(arrays):
+    sha = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha.update(str((array.dtype.str, array.shape)).encode())
+        sha.update(array.tobytes())
+    return sha.hexdigest()
+
+def hash_torch_weights(model):
+    state_dict = model.state_dict()
+    names = sorted(state_dict.keys())
+    sha = hashlib.sha1(' '.join(names).encode())
+    sha.update(hash_arrays([state_dict[name].detach().cpu().numpy() for name in names]).encode())
+    return sha.hexdigest()
+
+def hash_keras_weights(model):
+    return hash_arrays(model.get_weights())
+
+
+class PredictionCache(object):
+    '''On-disk cache of model predictions on clean images.
+
+    Entries are keyed by (model name, model weights hash, image content hash,
+    preprocessing params) and stored as one compressed .npz per image, with
+    one column per key of the prediction dictionary. Values are restored as
+    lists of numpy scalars/rows, so a cached prediction compares equal to a
+    fresh one. Predictions that cannot be stored as plain arrays are simply
+    not cached.
+    '''
+    _EMPTY = '__empty__'
+
+    def __init__(self, model_name, weights_hash, preprocess_params, cache_dir=DEFAULT_CACHE_DIR):
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, model_name)
+        self._key_prefix = json.dumps([model_name, weights_hash, preprocess_params], sort_keys=True, default=str)
+        self._image_hashes = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _image_hash(self, image_path):
+        stat = os.stat(image_path)
+        memo_key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime)
+        if memo_key not in self._image_hashes:
+            self._image_hashes[memo_key] = hash_file(image_path)
+        return self._image_hashes[memo_key]
+
+    def _entry_path(self, image_path):
+        key = hashlib.sha1((self._key_prefix + self._image_hash(image_path)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, image_path):
+        entry_path = self._entry_path(image_path)
+        if not os.path.isfile(entry_path):
+            return None
+        try:
+            with np.load(entry_path, allow_pickle=False) as data:
+                if self._EMPTY in data.files:
+                    return {}
+                return {column : list(data[column]) for column in data.files}
+        except (IOError, ValueError):
+            return None
+
+    def put(self, image_path, prediction):
+        if not prediction:
+            columns = {self._EMPTY : np.zeros(0)}
+        else:
+            columns = {}
+            for column, value in prediction.items():
+                value = np.asarray(value)
+                if value.dtype == object:
+                    return
+                columns[column] = value
+        entry_path = self._entry_path(image_path)
+        temp_path = entry_path + '.tmp'
+        with open(temp_path, 'wb') as outf:
+            np.savez_compressed(outf, **columns)
+        os.replace(temp_path, entry_path)
+
+    def get_or_compute(self, image_path, compute_fn):
+        '''cached prediction of image_path, compute_fn() is only called on a miss.'''
+        prediction = self.get(image_path)
+        if prediction is None:
+            prediction = compute_fn()
+            self.put(image_path, prediction)
+        return prediction
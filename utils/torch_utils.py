@@ -1,7 +1,15 @@
+import contextlib
+import copy
 import torch
 from torch.autograd import Variable
 import numpy as np
 
+# autocast dtype of each precision mode, fp32 runs without autocast.
+PRECISION_DTYPES = {
+    'fp32' : None,
+    'bf16' : torch.bfloat16,
+}
+
 def numpy_to_variable(image, device=torch.device('cuda:0')):
     if len(image.shape) == 3:
         x_image = np.expand_dims(image, axis=0)
@@ -15,6 +23,121 @@ def numpy_to_variable(image, device=torch.device('cuda:0')):
 def variable_to_numpy(variable):
     return variable.cpu().detach().numpy()
 
+class ModelExecution(object):
+    '''execution mode of the model an attack runs, the attack itself stays fp32 NCHW.
+
+    precision ('fp32' or 'bf16') runs the model ops under autocast and
+    channels_last uses NHWC weights and inputs. Only the model is affected:
+    the perturbation, its gradient and the epsilon projection stay in fp32,
+    and the NHWC copy of the input is differentiable, so gradients still
+    reach the NCHW perturbation.
+    '''
+    def __init__(self, device='cuda', precision='fp32', channels_last=False):
+        assert precision in PRECISION_DTYPES, 'Invalid precision {0}.'.format(precision)
+        self.device = torch.device(device)
+        self.precision = precision
+        self.channels_last = channels_last
+
+    def prepare(self, model):
+        '''copy of model on the device, with channels_last weights if asked for.'''
+        model = copy.deepcopy(model).to(self.device)
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    def autocast(self):
+        dtype = PRECISION_DTYPES[self.precision]
+        if dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=dtype)
+
+    def input(self, x):
+        if self.channels_last:
+            return x.contiguous(memory_format=torch.channels_last)
+        return x
+
+    def __call__(self, model, x):
+        '''fp32 output of a prepared model on x.'''
+        with self.autocast():
+            out = model(self.input(x))
+        return out.float()
+
+class _StopForward(Exception):
+    pass
+
+def stop_module_idx(modules, last_idx):
+    '''index of the module a pass capturing modules[last_idx] has to run up to.
+
+    An in-place activation right after modules[last_idx] (e.g. the
+    ReLU(inplace=True) following a VGG conv) overwrites its output in the
+    full pass, so that activation is run too.
+    '''
+    if last_idx + 1 < len(modules) and getattr(modules[last_idx + 1], 'inplace', False):
+        return last_idx + 1
+    return last_idx
+
+def forward_with_internals(model, modules, x, internal, with_pred=True):
+    '''run model on x once and collect the outputs of modules[i] for i in internal.
+
+    The outputs are captured with forward hooks, so they are exactly the
+    activations of model(x). When with_pred is False the forward pass is
+    stopped right after the deepest requested module, or after the in-place
+    activation consuming its output, and pred is None.
+
+    Returns:
+        (layers, pred), layers ordered by module index.
+    '''
+    internal = sorted(set(internal))
+    stop_idx = stop_module_idx(modules, internal[-1])
+    outputs = {}
+
+    def _make_hook(idx):
+        def _hook(module, input, output):
+            outputs[idx] = output
+        return _hook
+
+    def _stop_hook(module, input, output):
+        raise _StopForward()
+
+    handles = [modules[idx].register_forward_hook(_make_hook(idx)) for idx in internal]
+    if not with_pred:
+        handles.append(modules[stop_idx].register_forward_hook(_stop_hook))
+    pred = None
+    try:
+        pred = model(x)
+    except _StopForward:
+        pass
+    finally:
+        for handle in handles:
+            handle.remove()
+    layers = [outputs[idx] for idx in internal]
+    return layers, pred
+
+class TruncatedModel(torch.nn.Module):
+    '''sub-network made of the leading stages of a model.
+
+    stages is a list of (layer_idx, module) run in order, layer_idx being the
+    index of the module in the original model (None for helper stages such as
+    functional pooling). Calling it returns the outputs of the layers in
+    layer_idx_list, in that order; nothing after the deepest of them exists
+    in the sub-network, apart from an in-place activation that overwrites
+    its output in the full pass (see stop_module_idx).
+    '''
+    def __init__(self, stages, layer_idx_list):
+        super(TruncatedModel, self).__init__()
+        self.stage_idx = [idx for idx, _ in stages]
+        self.stages = torch.nn.ModuleList([module for _, module in stages])
+        self.layer_idx_list = list(layer_idx_list)
+        assert set(self.layer_idx_list).issubset(self.stage_idx)
+
+    def forward(self, x):
+        outputs = {}
+        for idx, stage in zip(self.stage_idx, self.stages):
+            x = stage(x)
+            if idx in self.layer_idx_list:
+                outputs[idx] = x
+        return [outputs[idx] for idx in self.layer_idx_list]
+
 def convert_torch_det_output(torch_out, cs_th=0.5):
     '''convert pytorch detection model output to list of dictionary of list
         [